@@ -0,0 +1,74 @@
+# Бенчмарк ядра TaskEngine без интерфейса: добавление, выполнение, сохранение, загрузка, поиск, календарь и напоминания
+# на разных объемах данных. Пример: python bench_core.py --sizes 1000,100000,1000000
+import argparse
+import datetime
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+app = importlib.import_module("Приложение")
+
+
+def measure(results, size, name, func, operations):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    results.append((size, name, operations, elapsed))
+
+
+def bench_size(size, sample, workdir):
+    results = []
+    db_path = os.path.join(workdir, f"bench_{size}.db")
+    start = datetime.date.today() - datetime.timedelta(days=365)
+    engine = app.TaskEngine(app.SQLiteStorage(db_path), save_window=3600)
+
+    def add():
+        for i in range(size):
+            engine.add_task(f"Задача {i % 1000}", start + datetime.timedelta(days=i % 730))
+
+    measure(results, size, "add", add, size)
+    measure(results, size, "save (все строки)", engine.flush, size)
+
+    task_ids = engine.tasks.ids[::max(1, size // sample)][:sample]
+
+    def complete():
+        for task_id in task_ids:
+            engine.toggle_task(task_id)
+
+    measure(results, size, "complete", complete, len(task_ids))
+    measure(results, size, "save (изменения)", engine.flush, len(task_ids))
+    measure(results, size, "reminder rebuild", engine.reschedule_reminders, size)
+    measure(results, size, "overdue scan", lambda: engine.tasks.open_due_before(datetime.date.today()), size)
+    measure(results, size, "search", lambda: engine.find_tasks("задача 12"), size)
+    measure(results, size, "due this week", lambda: engine.find_tasks(
+        first=datetime.date.today(), last=datetime.date.today() + datetime.timedelta(days=6)), size)
+    measure(results, size, "calendar month", lambda: engine.calendar_days(
+        datetime.date.today(), datetime.date.today() + datetime.timedelta(days=41)), size)
+    engine.close()
+
+    loaded = app.TaskEngine(app.SQLiteStorage(db_path))
+    measure(results, size, "load", loaded.load, size)
+    loaded.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк ядра TaskEngine")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="объемы задач через запятую")
+    parser.add_argument("--sample", type=int, default=10000, help="сколько задач отмечать выполненными")
+    args = parser.parse_args()
+    app.load_numpy()  # Импорт numpy не должен попадать в замеры
+
+    print(f"{'задач':>9} {'операция':<20} {'операций':>9} {'время, с':>9} {'операций/с':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(value) for value in args.sizes.split(",")):
+            for size, name, operations, elapsed in bench_size(size, args.sample, workdir):
+                rate = operations / elapsed if elapsed else float("inf")
+                print(f"{size:>9} {name:<20} {operations:>9} {elapsed:>9.3f} {rate:>12.0f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Замер времени запуска приложения: от старта процесса до первого кадра и до окончания загрузки данных.
+# Нужен графический дисплей. Пример: python bench_startup.py --runs 10 --tasks 100000
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Приложение.py")
+
+
+def make_data(path, task_count, habit_count):
+    # Синтетический data.json: при первом запуске приложение перенесет его в data.db
+    start = datetime.date(2024, 1, 1)
+    tasks = [{
+        "description": f"Задача {i}",
+        "due_date": (start + datetime.timedelta(days=i % 730)).strftime("%Y-%m-%d"),
+        "completed": i % 3 == 0
+    } for i in range(task_count)]
+    habits = [{
+        "description": f"Привычка {i}",
+        "frequency": ("daily", "weekly", "monthly")[i % 3],
+        "goal": "",
+        "completed_dates": {(start + datetime.timedelta(days=d)).strftime("%Y-%m-%d"): True
+                            for d in range(0, 730, 2)}
+    } for i in range(habit_count)]
+    with open(path, "w") as f:
+        json.dump({"tasks": tasks, "habits": habits, "user_profile": {"name": "Бенчмарк"}}, f, ensure_ascii=False)
+
+
+def run_once(workdir):
+    env = dict(os.environ, TASKMANAGER_STARTUP_BENCH="1")
+    started = time.time()
+    result = subprocess.run([sys.executable, APP_PATH], cwd=workdir, env=env,
+                            capture_output=True, text=True, timeout=600)
+    marks = {}
+    for line in result.stdout.splitlines():
+        name, _, value = line.partition(" ")
+        if name in ("first_frame", "data_loaded"):
+            marks[name] = float(value) - started
+    if "first_frame" not in marks:
+        raise RuntimeError(f"Приложение не сообщило о первом кадре:\n{result.stdout}\n{result.stderr}")
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер времени запуска приложения")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--habits", type=int, default=20)
+    parser.add_argument("--data-dir", help="каталог с готовыми data.db/data.json вместо синтетических данных")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.data_dir or tmp
+        if not args.data_dir:
+            make_data(os.path.join(workdir, "data.json"), args.tasks, args.habits)
+        run_once(workdir)  # Прогрев: перенос data.json в базу и кэш файловой системы
+
+        samples = {"first_frame": [], "data_loaded": []}
+        for _ in range(args.runs):
+            for name, value in run_once(workdir).items():
+                samples[name].append(value)
+
+    for name, values in samples.items():
+        if values:
+            print(f"{name}: медиана {statistics.median(values) * 1000:.1f} мс, "
+                  f"мин {min(values) * 1000:.1f} мс, макс {max(values) * 1000:.1f} мс ({len(values)} запусков)")
+
+
+if __name__ == "__main__":
+    main()
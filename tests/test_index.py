@@ -0,0 +1,48 @@
+# Поисковый индекс: удаленные задачи не находятся, возвращенные находятся ровно по новому описанию
+import datetime
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+app = importlib.import_module("Приложение")
+
+DAY = datetime.date(2024, 5, 1)
+
+
+def make_task(description, task_id):
+    return app.Task(description, DAY, False, task_id)
+
+
+def test_removed_task_is_not_found_and_can_return():
+    index = app.TaskIndex()
+    milk, bread = make_task("Купить молоко", "a"), make_task("Купить хлеб", "b")
+    index.add(milk)
+    index.add(bread)
+    index.remove(milk)
+    assert index.search("купить") == {"b"}
+    assert index.search('"молоко"') == set()
+
+    index.add(milk)  # Отмена удаления
+    assert index.search("купить") == {"a", "b"}
+    assert index.by_token["купить"].count("a") == 1
+
+    index.remove(milk)
+    index.add(make_task("Позвонить маме", "a"))  # Тот же id с другим описанием
+    assert index.search("молоко") == set()
+    assert index.search("купить") == {"b"}
+    assert index.search("мам") == {"a"}
+
+
+def test_compaction_drops_stale_ids_and_empty_tokens(monkeypatch):
+    monkeypatch.setattr(app.TaskIndex, "COMPACT_STALE", 3)
+    index = app.TaskIndex()
+    tasks = [make_task(f"Задача номер{i}", str(i)) for i in range(5)]
+    for task in tasks:
+        index.add(task)
+    for task in tasks[:3]:
+        index.remove(task)
+    assert index.stale == {}
+    assert sorted(index.by_token["задача"]) == ["3", "4"]
+    assert "номер0" not in index.by_token and "номер0" not in index.tokens
+    assert index.search("ном") == {"3", "4"}
@@ -0,0 +1,52 @@
+# Потоковый разбор JSON: результат не должен зависеть от того, где проходят границы кусков
+import importlib
+import io
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+app = importlib.import_module("Приложение")
+
+DOCUMENTS = [
+    '{"tasks": [-2.5e10]}',
+    '{"tasks": [1E+5, -0.125, 3e-7, 0, -0, 12345678901234567890], "n": -7.0e2}',
+    '{"tasks": [{"id": "a", "v": 0.5}, {"id": "b", "v": [1.5e3, true, false, null]}], "x": 2.0}',
+    '{"habits": [], "tasks": ["Привет", "кавычка \\" и \\\\ слеш", "\\u0416\\ud83d\\ude00"], "user_profile": {"level": 3}}',
+    '{ "tasks" : [ { "nested" : { "deep" : [ 1 , 2.25 , -3e2 ] } } ] , "user_profile" : null }',
+    '{}',
+]
+
+
+def parse(text, chunk_size):
+    f = io.BytesIO(text.encode("utf-8"))
+    result = {}
+    for key, value, is_item in app.iter_json_object(f, stream_keys=("tasks", "habits"), chunk_size=chunk_size):
+        if is_item:
+            result.setdefault(key, []).append(value)
+        else:
+            result[key] = value
+    return result
+
+
+def expected(text):
+    # Пустые потоковые массивы разбор не отдает вовсе
+    return {key: value for key, value in json.loads(text).items()
+            if not (key in ("tasks", "habits") and value == [])}
+
+
+@pytest.mark.parametrize("text", DOCUMENTS)
+def test_every_chunk_size_gives_same_result(text):
+    sizes = list(range(1, 18)) + random.Random(text).sample(range(18, 200), 10)
+    for chunk_size in sizes:
+        assert parse(text, chunk_size) == expected(text), chunk_size
+
+
+@pytest.mark.parametrize("text", ['{"tasks": [1.]}', '{"tasks": [2e]}', '{"tasks": [-]}', '{"tasks": [1, 2'])
+def test_malformed_input_raises(text):
+    for chunk_size in (1, 2, 7, 64):
+        with pytest.raises(ValueError):
+            parse(text, chunk_size)
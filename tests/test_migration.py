@@ -0,0 +1,93 @@
+# Перенос прежнего data.json в SQLite: поврежденный файл не должен ронять каждый запуск
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+app = importlib.import_module("Приложение")
+
+
+def write_legacy(path, data):
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def test_valid_legacy_file_is_migrated_on_load(tmp_path):
+    json_path = tmp_path / "data.json"
+    write_legacy(json_path, {
+        "tasks": [{"id": "t1", "description": "Задача", "due_date": "2024-05-01", "completed": False}],
+        "habits": [{"id": "h1", "description": "Зарядка", "frequency": "daily", "goal": "",
+                    "completed_dates": {"2024-05-01": True}}],
+        "user_profile": {"name": "Аня", "level": 2},
+    })
+    storage = app.SQLiteStorage(str(tmp_path / "data.db"), legacy_json=str(json_path))
+    tasks, habits, profile = storage.load()
+    storage.close()
+    assert [task.description for task in tasks] == ["Задача"]
+    assert list(habits[0].completed_dates) == ["2024-05-01"]
+    assert profile.name == "Аня"
+
+    # Повторная загрузка читает уже только базу
+    json_path.unlink()
+    storage = app.SQLiteStorage(str(tmp_path / "data.db"), legacy_json=str(json_path))
+    tasks, habits, profile = storage.load()
+    storage.close()
+    assert len(tasks) == 1 and len(habits) == 1 and profile.level == 2
+
+
+@pytest.mark.parametrize("content", [
+    '{"tasks": [{"id": "t1", "description": "Задача", "due_',
+    '{"tasks": [{"id": "t1", "description": "Задача", "due_date": "2024-13-45", "completed": false}]}',
+    '{"tasks": [{"id": "t1"}]}',
+])
+def test_corrupt_legacy_file_is_set_aside(tmp_path, content):
+    json_path = tmp_path / "data.json"
+    json_path.write_text(content, encoding="utf-8")
+    storage = app.SQLiteStorage(str(tmp_path / "data.db"), legacy_json=str(json_path))
+    with pytest.raises(ValueError):
+        storage.load()
+    assert not json_path.exists()
+    assert (tmp_path / "data.json.bad").read_text(encoding="utf-8") == content
+
+    # Следующий запуск начинается с пустой базы
+    tasks, habits, profile = storage.load()
+    storage.close()
+    assert tasks == [] and habits == [] and profile is None
+
+
+def test_failed_migration_leaves_no_partial_rows(tmp_path):
+    json_path = tmp_path / "data.json"
+    write_legacy(json_path, {"tasks": [
+        {"id": "t1", "description": "Первая", "due_date": "2024-05-01", "completed": False},
+        {"id": "t2", "description": "Вторая", "due_date": "не дата", "completed": False},
+    ]})
+    storage = app.SQLiteStorage(str(tmp_path / "data.db"), legacy_json=str(json_path))
+    batches = storage.load_batches(batch_size=1)
+    assert next(batches)[0] == "tasks"  # Первая порция уже записана в открытую транзакцию
+    with pytest.raises(ValueError):
+        list(batches)
+    tasks, habits, profile = storage.load()
+    storage.close()
+    assert tasks == [] and profile is None
+
+
+def test_legacy_file_in_locale_encoding_is_read(tmp_path, monkeypatch):
+    # Прежние версии писали data.json в кодировке системы, а не в UTF-8
+    monkeypatch.setattr(app.locale, "getpreferredencoding", lambda do_setlocale=True: "cp1251")
+    json_path = tmp_path / "data.json"
+    json_path.write_bytes(json.dumps({
+        "tasks": [{"id": "t1", "description": "Купить хлеб", "due_date": "2024-05-01", "completed": False}],
+        "user_profile": {"name": "Пётр"},
+    }, ensure_ascii=False).encode("cp1251"))
+    tasks, habits, profile = app.JsonStorage(str(json_path)).load()
+    assert tasks[0].description == "Купить хлеб"
+    assert profile.name == "Пётр"
+
+
+def test_json_storage_writes_utf8(tmp_path):
+    json_path = tmp_path / "data.json"
+    storage = app.JsonStorage(str(json_path))
+    storage.save([app.Task("Задача", app.parse_date("2024-05-01"))], [], app.UserProfile(name="Ёжик"))
+    assert "Ёжик" in json_path.read_bytes().decode("utf-8")
@@ -0,0 +1,57 @@
+# Прогресс квестов нельзя накрутить повторной отметкой одной и той же задачи или привычки
+import datetime
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+app = importlib.import_module("Приложение")
+
+
+def make_engine(tmp_path, quest_ids):
+    engine = app.TaskEngine(app.SQLiteStorage(str(tmp_path / "data.db")), save_window=3600)
+    engine.load()
+    engine.quest_engine = app.QuestEngine([quest for quest in app.DEFAULT_QUESTS if quest["id"] in quest_ids])
+    engine.assign_quests()
+    return engine
+
+
+def progress(engine, quest_id):
+    return {quest["id"]: value for quest, value in engine.quest_engine.progress()}.get(quest_id)
+
+
+def test_retoggling_task_does_not_add_progress(tmp_path):
+    engine = make_engine(tmp_path, {"tasks_3"})
+    task = engine.add_task("Задача", datetime.date.today())
+    for _ in range(4):
+        engine.toggle_task(task.id)
+    assert progress(engine, "tasks_3") == 1
+    other = engine.add_task("Другая", datetime.date.today())
+    engine.toggle_task(other.id)
+    assert progress(engine, "tasks_3") == 2
+    engine.close()
+
+
+def test_remarking_habit_does_not_add_progress(tmp_path):
+    engine = make_engine(tmp_path, {"weekly_habits_3"})
+    habit = engine.add_habit("Привычка", "weekly")
+    for _ in range(4):
+        engine.toggle_habit(habit.id)
+    assert progress(engine, "weekly_habits_3") == 1
+    engine.close()
+
+
+def test_expired_quest_is_reported_and_replaced(tmp_path):
+    engine = make_engine(tmp_path, {"habit_today", "tasks_3", "daily_streak_7", "weekly_habits_3"})
+    today = datetime.date.today()
+    if "habit_today" not in engine.quest_engine.active:
+        engine.quest_engine.remove(next(iter(engine.quest_engine.active)))
+        engine.quest_engine.activate("habit_today", today)
+    expired = []
+    engine.subscribe("quest_expired", lambda quest: expired.append(quest["id"]))
+
+    engine.expire_quests(today + datetime.timedelta(days=2))
+    assert expired == ["habit_today"]
+    assert len(engine.quest_engine.active) == app.MAX_ACTIVE_QUESTS
+    assert "habit_today" not in engine.quest_engine.active
+    engine.close()
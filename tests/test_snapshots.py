@@ -0,0 +1,61 @@
+# Регрессии снимков модели: запись и экспорт не должны видеть устаревшие колонки TaskStore
+import datetime
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+app = importlib.import_module("Приложение")
+
+
+def open_engine(path):
+    engine = app.TaskEngine(app.SQLiteStorage(str(path)), save_window=3600)
+    engine.load()
+    return engine
+
+
+def test_toggle_after_pinned_snapshot_is_saved(tmp_path):
+    path = tmp_path / "data.db"
+    engine = open_engine(path)
+    task = engine.add_task("Задача", datetime.date.today())
+    engine.flush()  # Поток записи забирает снимок, колонки становятся закрепленными
+    engine.toggle_task(task.id)
+    engine.flush()
+    engine.close()
+
+    engine = open_engine(path)
+    assert engine.tasks[task.id].completed
+    assert engine.user_profile.experience == 10
+    engine.close()
+
+
+def test_snapshot_after_copy_on_write_sees_new_values(tmp_path):
+    engine = open_engine(tmp_path / "data.db")
+    task = engine.add_task("Задача", datetime.date.today())
+    old = engine.publish()
+    assert old.tasks.take()
+    engine.toggle_task(task.id)
+    new = engine.publish()
+    assert new.tasks is not old.tasks
+    assert new.tasks.get(task.id).completed
+    assert not old.tasks.get(task.id).completed
+    engine.close()
+
+
+def test_taken_snapshot_keeps_rows_after_removal():
+    day = datetime.date(2024, 5, 1)
+    store = app.TaskStore([app.Task(description, day, False, description) for description in ("a", "b", "c")])
+    old = store.freeze()
+    assert old.take()
+    store.remove("a")  # Последняя строка переезжает на место удаленной
+    store.append(app.Task("d", day, False, "d"))  # И новая задача занимает строку, которая есть в снимке
+
+    assert [task.id for task in old] == ["a", "b", "c"]
+    assert old.get("a").description == "a"
+    assert old.get("c").description == "c"
+    assert "d" not in old
+    new = store.freeze()
+    assert sorted(task.id for task in new) == ["b", "c", "d"]
+    assert "a" not in new and new.get("c").description == "c"
+    assert [task.description for task in store] == ["c", "b", "d"]
+    assert store["c"].description == "c" and "a" not in store
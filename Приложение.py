@@ -1,110 +1,3106 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
+import array
+import bisect
+import codecs
+import collections
+import collections.abc
+import contextlib
+import csv
 import datetime
+import functools
+import hashlib
+import heapq
+import itertools
 import time
 import threading
 import json
+import locale
 import os
+import queue
 import random
-from PIL import Image, ImageTk  # Для работы с изображениями
+import re
+import sqlite3
+import tempfile
+import uuid
+import weakref
 
+# PIL, plyer и numpy импортируются при первом использовании, чтобы не замедлять запуск
+notification = None
+np = None
+HAS_PLYER = None  # None - импорт еще не выполнялся
+HAS_NUMPY = None
+STARTUP_BENCH = bool(os.environ.get("TASKMANAGER_STARTUP_BENCH"))  # Режим замера для bench_startup.py
 
-try:
-    from plyer import notification
-    HAS_PLYER = True
-except ImportError:
-    HAS_PLYER = False
-    print("plyer не установлен. Уведомления будут отображаться через messagebox.")
 
+def load_plyer():
+    global notification, HAS_PLYER
+    if HAS_PLYER is None:
+        try:
+            from plyer import notification
+            HAS_PLYER = True
+        except ImportError:
+            HAS_PLYER = False
+            print("plyer не установлен. Уведомления будут отображаться через messagebox.")
+    return HAS_PLYER
+
+
+def load_numpy():
+    # numpy ускоряет аналитику по привычкам и фильтры задач, без него используется обычный Python
+    global np, HAS_NUMPY
+    if HAS_NUMPY is None:
+        try:
+            import numpy as np
+            HAS_NUMPY = True
+        except ImportError:
+            HAS_NUMPY = False
+    return HAS_NUMPY
+
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+LOAD_BATCH_SIZE = 5000  # Сколько записей материализуется за один шаг цикла Tk при загрузке
+SQLITE_MAX_VARIABLES = 900  # Параметров в одном запросе; старые сборки SQLite допускают не больше 999
+
+
+def parse_date(text):
+    # Быстрый разбор ISO-даты "ГГГГ-ММ-ДД" (в разы быстрее strptime)
+    return datetime.date.fromisoformat(text)
+
+
+def detect_text_encoding(path, chunk_size=1 << 16):
+    # UTF-8, если файл целиком в нем читается, иначе кодировка системы:
+    # прежние версии писали data.json в ней (например, cp1251 в Windows)
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(chunk_size)
+                text_decoder.decode(data, final=not data)
+                if not data:
+                    return "utf-8"
+    except UnicodeDecodeError:
+        return locale.getpreferredencoding(False)
+
+
+def iter_json_object(f, stream_keys=(), chunk_size=1 << 16, encoding="utf-8"):
+    # Потоковый разбор JSON-объекта верхнего уровня из бинарного файла.
+    # Для ключей из stream_keys массив отдается поэлементно: (ключ, элемент, True),
+    # остальные значения целиком: (ключ, значение, False). Весь файл в памяти не держится
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        data = f.read(chunk_size)
+        if not data:
+            eof = True
+        buffer = buffer[pos:] + text_decoder.decode(data, final=eof)
+        pos = 0
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    def peek():
+        skip_ws()
+        if pos >= len(buffer):
+            raise json.JSONDecodeError("Неожиданный конец файла", buffer, pos)
+        return buffer[pos]
+
+    def expect(char):
+        nonlocal pos
+        if peek() != char:
+            raise json.JSONDecodeError(f"Ожидался символ '{char}'", buffer, pos)
+        pos += 1
+
+    def value():
+        nonlocal pos
+        skip_ws()
+        while True:
+            try:
+                result, end = decoder.raw_decode(buffer, pos)
+                # Число на границе буфера могло быть прочитано не полностью: "-2." или "2.5e" разбираются
+                # как -2 и 2.5, а продолжение ждет в следующем куске
+                cut = end == len(buffer) or (isinstance(result, (int, float)) and not isinstance(result, bool)
+                                             and buffer[end] in ".eE+-")
+                if not cut or eof:
+                    pos = end
+                    return result
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    expect("{")
+    if peek() == "}":
+        return
+    while True:
+        key = value()
+        expect(":")
+        if key in stream_keys and peek() == "[":
+            pos += 1
+            if peek() == "]":
+                pos += 1
+            else:
+                while True:
+                    yield key, value(), True
+                    if peek() == ",":
+                        pos += 1
+                        continue
+                    expect("]")
+                    break
+        else:
+            yield key, value(), False
+        if peek() == ",":
+            pos += 1
+            continue
+        expect("}")
+        return
+
+
+# --- Замеры производительности ---
+# TASKMANAGER_METRICS=1 (или путь к файлу) - писать замеры в JSON Lines с ротацией,
+# TASKMANAGER_DEBUG=1 - вкладка "Отладка" с p50/p99 по операциям,
+# TASKMANAGER_PROFILE_ACTIONS=N - снять cProfile первых N действий после запуска
+METRICS_FILE = "metrics.jsonl"
+METRICS_MAX_BYTES = 1 << 20  # Размер файла замеров до ротации
+METRICS_BACKUPS = 3
+LAG_CHECK_INTERVAL_MS = 100  # Как часто проверять задержку цикла Tk
+LAG_LOG_THRESHOLD = 0.05  # Задержки цикла от 50 мс попадают в файл
+
+
+class Metrics:
+    # Длительности операций: последние WINDOW значений по каждой операции для p50/p99,
+    # запись в файл JSON Lines с ротацией и захват cProfile на следующие N действий.
+    # Пока замеры выключены, декоратор timed только вызывает функцию
+    WINDOW = 1000
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=self.WINDOW))
+        self.counts = collections.Counter()
+        self.local = threading.local()  # Глубина вложенных замеров: действие - вызов верхнего уровня
+        self._lock = threading.Lock()
+        self._log = None
+        self._profile = None
+        self._profile_thread = None
+        self.profile_left = 0
+        self.profile_path = None
+
+    def enable(self, path=None):
+        # path - файл для записи замеров, без него замеры только в памяти
+        self.enabled = True
+        if path and self._log is None:
+            import logging.handlers
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=METRICS_MAX_BYTES,
+                                                           backupCount=METRICS_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._log = logging.getLogger("taskmanager.metrics")
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            self._log.addHandler(handler)
+
+    def record(self, name, seconds, top=False, log=True):
+        with self._lock:
+            self.samples[name].append(seconds)
+            self.counts[name] += 1
+        if self._log is not None and log:
+            self._log.info(json.dumps({"time": round(time.time(), 3), "op": name,
+                                      "ms": round(seconds * 1000, 3), "thread": threading.current_thread().name}))
+        if top and self._profile is not None and threading.get_ident() == self._profile_thread:
+            self.profile_left -= 1
+            if self.profile_left <= 0:
+                self.stop_profile()
+
+    def percentiles(self):
+        # [(операция, число вызовов, p50, p99, максимум)] по последним замерам, секунды
+        with self._lock:
+            snapshot = [(name, self.counts[name], sorted(values)) for name, values in self.samples.items()]
+        rows = []
+        for name, count, values in snapshot:
+            if values:
+                rows.append((name, count, values[(len(values) - 1) // 2],
+                             values[int((len(values) - 1) * 0.99)], values[-1]))
+        return sorted(rows)
+
+    def profile_next(self, actions, path):
+        # cProfile текущего потока на следующие actions действий, результат - в path (pstats)
+        import cProfile
+        self.stop_profile()
+        self.enable()
+        self.profile_path = path
+        self.profile_left = actions
+        self._profile_thread = threading.get_ident()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop_profile(self):
+        profile, self._profile = self._profile, None
+        if profile is None:
+            return None
+        profile.disable()
+        profile.dump_stats(self.profile_path)
+        print(f"Профиль сохранен в {self.profile_path}")
+        return self.profile_path
+
+    @property
+    def profiling(self):
+        return self._profile is not None
+
+
+METRICS = Metrics()
+
+
+def timed(name=None):
+    # Декоратор замера длительности: METRICS.record(имя, секунды) после каждого вызова
+    def decorate(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return func(*args, **kwargs)
+            local = METRICS.local
+            local.depth = getattr(local, "depth", 0) + 1
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                local.depth -= 1
+                METRICS.record(label, elapsed, top=local.depth == 0)
+        return wrapper
+    return decorate
+
+
+class Task:
+    __slots__ = ("id", "description", "due_date", "completed", "completed_on")
+
+    def __init__(self, description, due_date, completed=False, task_id=None, completed_on=None):
+        self.id = task_id or uuid.uuid4().hex  # Стабильный идентификатор для хранилища
+        self.description = description
+        self.due_date = due_date
+        self.completed = completed
+        self.completed_on = completed_on  # Дата, когда задача была отмечена выполненной
+
+    def __str__(self):
+        return f"{self.description} (Срок: {self.due_date.strftime('%Y-%m-%d')})"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "description": self.description,
+            "due_date": self.due_date.strftime("%Y-%m-%d"),
+            "completed": self.completed,
+            "completed_on": self.completed_on.strftime("%Y-%m-%d") if self.completed_on else None
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        completed_on = data.get("completed_on")
+        return cls(data["description"], parse_date(data["due_date"]), data["completed"], data.get("id"),
+                   parse_date(completed_on) if completed_on else None)
+
+
+class TaskView:
+    # Задача внутри TaskStore: те же атрибуты, что у Task, но данные лежат в колонках хранилища
+    __slots__ = ("_store", "id")
+
+    def __init__(self, store, task_id):
+        self._store = store
+        self.id = task_id
+
+    def _row(self):
+        return self._store.rows[self.id]
+
+    @property
+    def description(self):
+        return self._store.descriptions[self._store.description_index[self._row()]]
+
+    @description.setter
+    def description(self, value):
+        self._store.writable("description_index")[self._row()] = self._store.intern(value)
+
+    @property
+    def due_date(self):
+        return datetime.date.fromordinal(self._store.due[self._row()])
+
+    @due_date.setter
+    def due_date(self, value):
+        self._store.writable("due")[self._row()] = value.toordinal()
+
+    @property
+    def completed(self):
+        return bool(self._store.completed[self._row()])
+
+    @completed.setter
+    def completed(self, value):
+        self._store.writable("completed")[self._row()] = 1 if value else 0
+
+    @property
+    def completed_on(self):
+        ordinal = self._store.completed_on[self._row()]
+        return datetime.date.fromordinal(ordinal) if ordinal else None
+
+    @completed_on.setter
+    def completed_on(self, value):
+        self._store.writable("completed_on")[self._row()] = value.toordinal() if value else 0
+
+    def __eq__(self, other):
+        return isinstance(other, TaskView) and other._store is self._store and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    __str__ = Task.__str__
+    to_dict = Task.to_dict
+
+
+class TaskStore:
+    # Колоночное хранение задач: сроки и даты выполнения - порядковые номера дней в array,
+    # выполнение - байт на задачу, описания - через общую таблицу строк.
+    # Снаружи - упорядоченная коллекция задач с доступом по id
+    COLUMNS = ("ids", "due", "completed", "completed_on", "description_index")
+
+    def __init__(self, tasks=()):
+        self.ids = []
+        self.rows = {}  # id -> номер строки
+        self.due = array.array("i")
+        self.completed = bytearray()
+        self.completed_on = array.array("i")  # 0 - задача не выполнена
+        self.description_index = array.array("i")
+        self.descriptions = []  # Только дополняется, поэтому снимки читают ее без копирования
+        self._description_lookup = {}
+        self._frozen = None  # Последний снимок, делящий колонки с хранилищем
+        self._pinned = set()  # Колонки, которые читает взятый снимок: перед изменением на месте их копируем
+        # rows не копируется: взятые снимки получают прежние номера строк через свой row_overlay
+        self._row_readers = weakref.WeakSet()
+        self.rows_version = 0  # Растет при каждом изменении rows на месте
+        self._pin_lock = threading.Lock()
+        self.extend(tasks)
+
+    def freeze(self):
+        # Снимок для других потоков за O(1): колонки общие. Добавление в конец снимку не мешает - он помнит
+        # свою длину, а перед изменением на месте колонка копируется, если снимок уже взят читателем
+        frozen = self._frozen
+        if (frozen is None or not frozen.valid or frozen.length != len(self.ids)
+                or frozen.rows_version != self.rows_version
+                or any(getattr(frozen, name) is not getattr(self, name) for name in self.COLUMNS)):
+            frozen = self._frozen = TaskSnapshot(self)
+        return frozen
+
+    def pin(self, snapshot):
+        # Читатель забирает снимок; False - снимок устарел: его никто не взял, и хранилище изменили на месте
+        with self._pin_lock:
+            if not snapshot.valid or snapshot.rows_version != self.rows_version:
+                return False
+            snapshot.taken = True
+            self._pinned.update(name for name in self.COLUMNS if getattr(self, name) is getattr(snapshot, name))
+            self._row_readers.add(snapshot)
+            return True
+
+    def writable(self, name):
+        # Колонка для изменения на месте (копирование при записи)
+        with self._pin_lock:
+            column = getattr(self, name)
+            if name in self._pinned:
+                self._pinned.discard(name)
+                column = column[:]
+                setattr(self, name, column)
+                self._frozen = None  # Снимок читает прежнюю колонку, для следующей публикации нужен новый
+            frozen = self._frozen
+            if frozen is not None and not frozen.taken and getattr(frozen, name) is column:
+                frozen.valid = False  # Снимок еще никто не взял - дешевле выбросить его, чем копировать колонку
+                self._frozen = None
+        return column
+
+    def intern(self, description):
+        index = self._description_lookup.get(description)
+        if index is None:
+            index = len(self.descriptions)
+            self.descriptions.append(description)
+            self._description_lookup[description] = index
+        return index
+
+    def append(self, task):
+        self.rows[task.id] = len(self.ids)
+        self.ids.append(task.id)
+        self.due.append(task.due_date.toordinal())
+        self.completed.append(1 if task.completed else 0)
+        self.completed_on.append(task.completed_on.toordinal() if task.completed_on else 0)
+        self.description_index.append(self.intern(task.description))
+        return TaskView(self, task.id)
+
+    def extend(self, tasks):
+        for task in tasks:
+            self.append(task)
+
+    def _set_row(self, task_id, row):
+        # Изменение rows на месте (row=None - удалить); взятые снимки сначала запоминают прежний номер строки
+        with self._pin_lock:
+            old_row = self.rows.get(task_id)
+            for snapshot in self._row_readers:
+                snapshot.row_overlay.setdefault(task_id, old_row)
+            self.rows_version += 1
+            if row is None:
+                del self.rows[task_id]
+            else:
+                self.rows[task_id] = row
+
+    def remove(self, task_id):
+        # На место удаленной строки переносится последняя: O(1) вместо сдвига и перенумерации всех следующих.
+        # Порядок задач при этом меняется - последняя задача встает на место удаленной
+        row = self.rows[task_id]
+        last = len(self.ids) - 1
+        moved_id = self.ids[last]
+        for name in self.COLUMNS:
+            column = self.writable(name)
+            column[row] = column[last]
+            del column[last]
+        self._set_row(task_id, None)
+        if row != last:
+            self._set_row(moved_id, row)
+
+    def get(self, task_id, default=None):
+        return TaskView(self, task_id) if task_id in self.rows else default
+
+    def __getitem__(self, task_id):
+        if task_id not in self.rows:
+            raise KeyError(task_id)
+        return TaskView(self, task_id)
+
+    def __contains__(self, task_id):
+        return task_id in self.rows
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (TaskView(self, task_id) for task_id in self.ids)
+
+    def open_due_before(self, day):
+        # id невыполненных задач со сроком раньше day, например просроченных на сегодня
+        limit = day.toordinal()
+        if load_numpy():
+            due = np.frombuffer(self.due, dtype=np.int32)
+            completed = np.frombuffer(self.completed, dtype=np.uint8)
+            return [self.ids[row] for row in np.flatnonzero((due < limit) & (completed == 0)).tolist()]
+        return [task_id for task_id, due, completed in zip(self.ids, self.due, self.completed)
+                if due < limit and not completed]
+
+
+class TaskSnapshot:
+    # Задачи на момент TaskStore.freeze для чтения из других потоков; задачи отдаются отдельными объектами Task
+    def __init__(self, store):
+        self.store = store
+        for name in TaskStore.COLUMNS:
+            setattr(self, name, getattr(store, name))
+        self.rows = store.rows
+        self.rows_version = store.rows_version
+        self.row_overlay = {}  # id -> номер строки (None - задачи не было) до изменения rows после взятия снимка
+        self.descriptions = store.descriptions
+        self.length = len(store.ids)
+        self.valid = True
+        self.taken = False
+
+    def take(self):
+        return self.store.pin(self)
+
+    def _task(self, row):
+        completed_on = self.completed_on[row]
+        return Task(self.descriptions[self.description_index[row]], datetime.date.fromordinal(self.due[row]),
+                    bool(self.completed[row]), self.ids[row],
+                    datetime.date.fromordinal(completed_on) if completed_on else None)
+
+    def _row(self, task_id):
+        # rows читается раньше overlay: TaskStore._set_row пишет overlay до изменения rows, поэтому
+        # увиденный новый номер строки всегда перекрывается прежним из overlay. Добавление в rows идет
+        # без overlay, и после удалений новая задача может занять строку внутри снимка - отсекаем по id
+        row = self.row_overlay.get(task_id, self.rows.get(task_id))
+        return None if row is None or row >= self.length or self.ids[row] != task_id else row
+
+    def get(self, task_id, default=None):
+        row = self._row(task_id)
+        return default if row is None else self._task(row)
+
+    def __contains__(self, task_id):
+        return self._row(task_id) is not None
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return (self._task(row) for row in range(self.length))
+
+
+class DayIndex:
+    # Множества id по дню и отсортированный список дней: выборка за период - двоичным поиском по списку
+    def __init__(self):
+        self.by_day = {}  # Порядковый номер дня -> множество id
+        self.days = []
+
+    def add(self, day, item_id):
+        ids = self.by_day.get(day)
+        if ids is None:
+            ids = self.by_day[day] = set()
+            bisect.insort(self.days, day)
+        ids.add(item_id)
+
+    def discard(self, day, item_id):
+        ids = self.by_day.get(day)
+        if ids is None:
+            return
+        ids.discard(item_id)
+        if not ids:
+            del self.by_day[day]
+            del self.days[bisect.bisect_left(self.days, day)]
+
+    def between(self, first=None, last=None):
+        # id за дни first..last включительно, None - без ограничения с этой стороны
+        start = 0 if first is None else bisect.bisect_left(self.days, first)
+        stop = len(self.days) if last is None else bisect.bisect_right(self.days, last)
+        result = set()
+        for day in self.days[start:stop]:
+            result |= self.by_day[day]
+        return result
+
+
+class TaskIndex:
+    # Индексы для поиска и фильтров: слова описаний -> списки id задач (со списком слов для поиска по префиксу)
+    # и сроки задач - всех и невыполненных. Обновляются по одной задаче при добавлении и отметке
+    TOKEN_RE = re.compile(r"\w+")
+    COMPACT_STALE = 4096  # После стольких удалений удаленные id вычищаются из списков
+
+    def __init__(self):
+        self.reset(TaskStore())
+
+    @classmethod
+    def tokenize(cls, text):
+        return set(cls.TOKEN_RE.findall(text.lower().replace("ё", "е")))
+
+    def reset(self, store):
+        # Список id на слово в несколько раз компактнее множества; удаление из списка стоило бы O(длины),
+        # поэтому удаленные задачи только помечаются в stale и отбрасываются при поиске
+        self.by_token = {}
+        self.tokens = []  # Отсортированные слова для поиска по префиксу
+        self.stale = {}  # id удаленных задач, еще оставшихся в списках -> прежнее описание
+        self.due = DayIndex()
+        self.open_due = DayIndex()
+        # Описания хранятся в TaskStore один раз, поэтому слова индексируются сразу для всех задач с описанием
+        ids_by_description = collections.defaultdict(list)
+        for task_id, due, completed, description in zip(store.ids, store.due, store.completed,
+                                                        store.description_index):
+            ids_by_description[description].append(task_id)
+            self.due.add(due, task_id)
+            if not completed:
+                self.open_due.add(due, task_id)
+        for description, ids in ids_by_description.items():
+            for token in self.tokenize(store.descriptions[description]):
+                postings = self.by_token.get(token)
+                if postings is None:
+                    self.by_token[token] = ids.copy()
+                else:
+                    postings.extend(ids)
+        self.tokens = sorted(self.by_token)
+
+    def _add_tokens(self, task_id, tokens):
+        for token in tokens:
+            ids = self.by_token.get(token)
+            if ids is None:
+                ids = self.by_token[token] = []
+                bisect.insort(self.tokens, token)
+            ids.append(task_id)
+
+    def add(self, task):
+        tokens = self.tokenize(task.description)
+        old_description = self.stale.pop(task.id, None)
+        if old_description is not None:
+            # Задача возвращается (например, отменой удаления), а ее id еще лежит в списках прежних слов
+            old_tokens = self.tokenize(old_description)
+            for token in old_tokens - tokens:
+                self.by_token[token].remove(task.id)
+            tokens -= old_tokens
+        self._add_tokens(task.id, tokens)
+        due = task.due_date.toordinal()
+        self.due.add(due, task.id)
+        if not task.completed:
+            self.open_due.add(due, task.id)
+
+    def remove(self, task):
+        self.stale[task.id] = task.description
+        if len(self.stale) >= self.COMPACT_STALE:
+            self.compact()
+        due = task.due_date.toordinal()
+        self.due.discard(due, task.id)
+        self.open_due.discard(due, task.id)
+
+    def compact(self):
+        # Вычищает удаленные id из списков их слов; слова без задач убираются из индекса
+        tokens = set()
+        for description in set(self.stale.values()):
+            tokens |= self.tokenize(description)
+        for token in tokens:
+            ids = [task_id for task_id in self.by_token[token] if task_id not in self.stale]
+            if ids:
+                self.by_token[token] = ids
+            else:
+                del self.by_token[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+        self.stale = {}
+
+    def completion_changed(self, task):
+        due = task.due_date.toordinal()
+        if task.completed:
+            self.open_due.discard(due, task.id)
+        else:
+            self.open_due.add(due, task.id)
+
+    def with_prefix(self, prefix):
+        result = set()
+        i = bisect.bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            result.update(self.by_token[self.tokens[i]])
+            i += 1
+        result.difference_update(self.stale)
+        return result
+
+    def search(self, query):
+        # Все слова запроса должны встретиться в описании. Слово в кавычках ищется целиком,
+        # остальные - по началу слова, чтобы результат обновлялся по мере ввода
+        result = None
+        for exact, prefix in re.findall(r'"([^"]*)"?|(\S+)', query.lower().replace("ё", "е")):
+            for token in self.TOKEN_RE.findall(exact):
+                matches = set(self.by_token.get(token, ()))
+                matches.difference_update(self.stale)
+                result = matches if result is None else result & matches
+            for token in self.TOKEN_RE.findall(prefix):
+                matches = self.with_prefix(token)
+                result = matches if result is None else result & matches
+        return result
+
+    def due_between(self, first=None, last=None, open_only=False):
+        index = self.open_due if open_only else self.due
+        return index.between(first and first.toordinal(), last and last.toordinal())
+
+
+class CompletionBitmap(collections.abc.MutableMapping):
+    # Отметки привычки в виде битовой карты по порядковому номеру дня.
+    # Снаружи ведет себя как прежний словарь {"ГГГГ-ММ-ДД": True}, ключом может быть и datetime.date
+    def __init__(self, completed_dates=None):
+        self.start = None  # Порядковый номер дня для нулевого бита, кратен 8
+        self.bits = bytearray()
+        self._count = 0
+        for day in completed_dates or ():
+            self.mark(day)
+
+    @staticmethod
+    def _ordinal(day):
+        if isinstance(day, str):
+            day = datetime.date.fromisoformat(day)
+        return day.toordinal()
+
+    def _offset(self, ordinal):
+        if self.start is None:
+            return -1
+        offset = ordinal - self.start
+        return offset if offset < len(self.bits) * 8 else -1
+
+    def has_day(self, day):
+        offset = self._offset(self._ordinal(day))
+        return offset >= 0 and bool(self.bits[offset >> 3] & (1 << (offset & 7)))
+
+    def mark(self, day):
+        ordinal = self._ordinal(day)
+        if self.start is None:
+            self.start = ordinal - ordinal % 8
+        elif ordinal < self.start:
+            new_start = ordinal - ordinal % 8
+            self.bits[0:0] = bytes((self.start - new_start) // 8)
+            self.start = new_start
+        offset = ordinal - self.start
+        if offset >= len(self.bits) * 8:
+            self.bits.extend(bytes(offset // 8 + 1 - len(self.bits)))
+        mask = 1 << (offset & 7)
+        if not self.bits[offset >> 3] & mask:
+            self.bits[offset >> 3] |= mask
+            self._count += 1
+
+    def unmark(self, day):
+        offset = self._offset(self._ordinal(day))
+        if offset >= 0 and self.bits[offset >> 3] & (1 << (offset & 7)):
+            self.bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+            self._count -= 1
+            return True
+        return False
+
+    def any_between(self, first_day, last_day):
+        ordinal = first_day.toordinal()
+        last = last_day.toordinal()
+        while ordinal <= last:
+            offset = self._offset(ordinal)
+            if offset >= 0 and self.bits[offset >> 3] & (1 << (offset & 7)):
+                return True
+            ordinal += 1
+        return False
+
+    def ordinals(self):
+        # Порядковые номера отмеченных дней по возрастанию
+        for index, byte in enumerate(self.bits):
+            while byte:
+                low = byte & -byte
+                yield self.start + index * 8 + low.bit_length() - 1
+                byte ^= low
+
+    def days(self):
+        return (datetime.date.fromordinal(ordinal) for ordinal in self.ordinals())
+
+    def __contains__(self, day):
+        try:
+            return self.has_day(day)
+        except (TypeError, ValueError):
+            return False
+
+    def __getitem__(self, day):
+        if day not in self:
+            raise KeyError(day)
+        return True
+
+    def __setitem__(self, day, value):
+        if value:
+            self.mark(day)
+        else:
+            self.unmark(day)
+
+    def __delitem__(self, day):
+        if not self.unmark(day):
+            raise KeyError(day)
+
+    def __iter__(self):
+        return (day.strftime("%Y-%m-%d") for day in self.days())
+
+    def __len__(self):
+        return self._count
+
+    def copy(self):
+        bitmap = CompletionBitmap()
+        bitmap.start, bitmap.bits, bitmap._count = self.start, bytearray(self.bits), self._count
+        return bitmap
+
+    def to_dict(self):
+        return {key: True for key in self}
+
+
+class Habit:
+    __slots__ = ("id", "description", "frequency", "goal", "completed_dates")
+
+    def __init__(self, description, frequency, goal="", completed_dates=None, habit_id=None):
+        self.id = habit_id or uuid.uuid4().hex
+        self.description = description
+        self.frequency = frequency  # "daily", "weekly", "monthly"
+        self.goal = goal
+        self.completed_dates = CompletionBitmap(completed_dates)
+
+    def __str__(self):
+        return f"{self.description} ({self.frequency})"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "description": self.description,
+            "frequency": self.frequency,
+            "goal": self.goal,
+            "completed_dates": self.completed_dates.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["description"], data["frequency"], data["goal"], data["completed_dates"], data.get("id"))
+
+
+class UserProfile:
+    __slots__ = ("name", "level", "experience", "quests_completed", "avatar_path", "birth_year", "active_quests")
+
+    def __init__(self, name="Новый пользователь", level=1, experience=0, quests_completed=0, avatar_path=None, birth_year=None,
+                 active_quests=None):
+        self.name = name
+        self.level = level
+        self.experience = experience
+        self.quests_completed = quests_completed
+        self.avatar_path = avatar_path  # Путь к файлу аватарки
+        self.birth_year = birth_year
+        self.active_quests = active_quests or []  # Состояния активных квестов, см. QuestEngine
+
+    def copy(self):
+        # Состояния квестов не меняются на месте, а заменяются целиком, поэтому список общий
+        return UserProfile(self.name, self.level, self.experience, self.quests_completed, self.avatar_path,
+                           self.birth_year, self.active_quests)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "level": self.level,
+            "experience": self.experience,
+            "quests_completed": self.quests_completed,
+            "avatar_path": self.avatar_path,
+            "birth_year": self.birth_year,
+            "active_quests": self.active_quests
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            name=data.get("name", "Новый пользователь"),
+            level=data.get("level", 1),
+            experience=data.get("experience", 0),
+            quests_completed=data.get("quests_completed", 0),
+            avatar_path=data.get("avatar_path"),
+            birth_year=data.get("birth_year"),
+            active_quests=data.get("active_quests")
+        )
+
+
+class Storage:
+    # Базовый интерфейс хранилища: TaskManager работает только через load_batches/save
+    def load_batches(self, batch_size=LOAD_BATCH_SIZE):
+        # Генератор (вид, объекты, доля прочитанного); вид - "tasks", "habits" или "user_profile"
+        raise NotImplementedError
+
+    def load(self):
+        tasks, habits, user_profile = [], [], None
+        for kind, items, _ in self.load_batches():
+            if kind == "tasks":
+                tasks.extend(items)
+            elif kind == "habits":
+                habits.extend(items)
+            else:
+                user_profile = items[0]
+        return tasks, habits, user_profile
+
+    def save(self, tasks, habits, user_profile, changed=None, removed=()):
+        # changed - объекты Task/Habit, изменившиеся с прошлого сохранения (None - полная проверка),
+        # removed - удаленные с тех пор пары ("task" или "habit", id)
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonStorage(Storage):
+    # Прежний формат: весь набор данных в одном JSON-файле
+    def __init__(self, path):
+        self.path = path
+
+    def load_batches(self, batch_size=LOAD_BATCH_SIZE):
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path) or 1
+        factories = {"tasks": Task.from_dict, "habits": Habit.from_dict}
+        encoding = detect_text_encoding(self.path)
+        with open(self.path, "rb") as f:
+            batch_kind, batch = None, []
+            for key, value, is_item in iter_json_object(f, stream_keys=factories, encoding=encoding):
+                if batch and (key != batch_kind or len(batch) >= batch_size):
+                    yield batch_kind, batch, f.tell() / size
+                    batch = []
+                if is_item:
+                    batch_kind = key
+                    batch.append(factories[key](value))
+                elif key == "user_profile" and value:
+                    yield key, [UserProfile.from_dict(value)], f.tell() / size
+            if batch:
+                yield batch_kind, batch, 1.0
+
+    @timed()
+    def save(self, tasks, habits, user_profile, changed=None, removed=()):
+        data = {
+            "tasks": [task.to_dict() for task in tasks],
+            "habits": [habit.to_dict() for habit in habits],
+            "user_profile": user_profile.to_dict()
+        }
+        # Пишем во временный файл и подменяем им основной, чтобы не оставить файл недописанным
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class SQLiteStorage(Storage):
+    # Построчное хранение в SQLite: сохранение пишет только изменившиеся строки
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT NOT NULL UNIQUE,
+            description TEXT NOT NULL,
+            due_date TEXT NOT NULL,
+            completed INTEGER NOT NULL,
+            completed_on TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks(due_date);
+        CREATE INDEX IF NOT EXISTS idx_tasks_completed ON tasks(completed);
+        CREATE TABLE IF NOT EXISTS habits (
+            id TEXT NOT NULL UNIQUE,
+            description TEXT NOT NULL,
+            frequency TEXT NOT NULL,
+            goal TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS habit_completions (
+            habit_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            PRIMARY KEY (habit_id, day)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+    UPSERT_TASK = ("INSERT INTO tasks (id, description, due_date, completed, completed_on) VALUES (?, ?, ?, ?, ?) "
+                   "ON CONFLICT(id) DO UPDATE SET description = excluded.description, due_date = excluded.due_date, "
+                   "completed = excluded.completed, completed_on = excluded.completed_on")
+    UPSERT_HABIT = ("INSERT INTO habits (id, description, frequency, goal) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET description = excluded.description, "
+                    "frequency = excluded.frequency, goal = excluded.goal")
+
+    def __init__(self, path, legacy_json=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._upgrade_schema()
+        self._profile_json = None  # Последний записанный профиль - чтобы не переписывать его без изменений
+        self.legacy_json = legacy_json  # Переносится при первой загрузке, уже после показа окна
+
+    def _upgrade_schema(self):
+        # Базы, созданные до появления новых столбцов
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+        if "completed_on" not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE tasks ADD COLUMN completed_on TEXT")
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _needs_migration(self):
+        if not self.legacy_json or not os.path.exists(self.legacy_json):
+            return False
+        with self._lock:
+            return not self._get_meta("json_migrated")
+
+    def _migrate_from_json(self, json_path, batch_size):
+        # Однократный перенос данных из data.json: порции JSON сразу пишутся в базу и отдаются модели,
+        # весь файл в памяти не собирается. Перенос идет одной транзакцией, чтобы прерванный не оставил
+        # в базе половину данных. Поврежденный файл откладывается в data.json.bad, иначе ошибка
+        # повторялась бы при каждом запуске
+        user_profile = None
+        committed = False
+        try:
+            with self._lock:
+                for table in ("tasks", "habits", "habit_completions"):
+                    self._conn.execute(f"DELETE FROM {table}")
+            for kind, items, progress in JsonStorage(json_path).load_batches(batch_size):
+                with self._lock:
+                    if kind == "tasks":
+                        self._conn.executemany(self.UPSERT_TASK, [self._task_row(task) for task in items])
+                    elif kind == "habits":
+                        self._conn.executemany(self.UPSERT_HABIT, [self._habit_row(habit) for habit in items])
+                        self._conn.executemany("INSERT OR IGNORE INTO habit_completions (habit_id, day) VALUES (?, ?)",
+                                               [(habit.id, day) for habit in items for day in habit.completed_dates])
+                    else:
+                        user_profile = items[0]
+                yield kind, items, progress
+            if user_profile is None:
+                user_profile = UserProfile()
+                yield "user_profile", [user_profile], 1.0
+            profile_json = json.dumps(user_profile.to_dict(), ensure_ascii=False)
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('user_profile', ?)",
+                                   (profile_json,))
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                                   (json_path,))
+                self._conn.commit()
+            committed = True
+            self._profile_json = profile_json
+        except (ValueError, KeyError, TypeError) as e:
+            os.replace(json_path, json_path + ".bad")
+            print(f"Не удалось перенести данные из {json_path}: {e}. Файл сохранен как {json_path}.bad")
+            raise ValueError(f"Файл {json_path} поврежден: {e}") from e
+        finally:
+            if not committed:
+                with self._lock:
+                    self._conn.rollback()
+        print(f"Данные перенесены из {json_path} в {self.path}")
+
+    @staticmethod
+    def _task_row(task):
+        return (task.id, task.description, task.due_date.strftime("%Y-%m-%d"), int(task.completed),
+                task.completed_on.strftime("%Y-%m-%d") if task.completed_on else None)
+
+    @staticmethod
+    def _habit_row(habit):
+        return habit.id, habit.description, habit.frequency, habit.goal
+
+    def load_batches(self, batch_size=LOAD_BATCH_SIZE):
+        if self._needs_migration():
+            yield from self._migrate_from_json(self.legacy_json, batch_size)
+            return
+        with self._lock:
+            task_count = self._conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+            habit_count = self._conn.execute("SELECT COUNT(*) FROM habits").fetchone()[0]
+            self._profile_json = self._get_meta("user_profile")
+        total = task_count + habit_count or 1
+        if self._profile_json:
+            yield "user_profile", [UserProfile.from_dict(json.loads(self._profile_json))], 0.0
+
+        loaded = 0
+        cursor = self._conn.cursor()
+        cursor.execute("SELECT id, description, due_date, completed, completed_on FROM tasks ORDER BY rowid")
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            tasks = [Task(row[1], parse_date(row[2]), bool(row[3]), row[0], parse_date(row[4]) if row[4] else None)
+                     for row in rows]
+            loaded += len(tasks)
+            yield "tasks", tasks, loaded / total
+
+        cursor.execute("SELECT id, description, frequency, goal FROM habits ORDER BY rowid")
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+                completions = {}
+                for start in range(0, len(rows), SQLITE_MAX_VARIABLES):
+                    habit_ids = [row[0] for row in rows[start:start + SQLITE_MAX_VARIABLES]]
+                    placeholders = ",".join("?" * len(habit_ids))
+                    for habit_id, day in self._conn.execute(
+                            f"SELECT habit_id, day FROM habit_completions WHERE habit_id IN ({placeholders})",
+                            habit_ids):
+                        completions.setdefault(habit_id, []).append(day)
+            if not rows:
+                break
+            habits = [Habit(row[1], row[2], row[3], completions.get(row[0], []), row[0]) for row in rows]
+            loaded += len(habits)
+            yield "habits", habits, loaded / total
+
+    @timed()
+    def save(self, tasks, habits, user_profile, changed=None, removed=()):
+        with self._lock, self._conn:
+            self._delete_tasks([item_id for kind, item_id in removed if kind == "task"])
+            self._delete_habits([item_id for kind, item_id in removed if kind == "habit"])
+            if changed is None:
+                self._save_all(tasks, habits)
+            else:
+                for item in changed:
+                    if isinstance(item, Habit):
+                        self._upsert_habit(item)
+                    else:
+                        self._upsert_task(item)
+
+            profile_json = json.dumps(user_profile.to_dict(), ensure_ascii=False)
+            if profile_json != self._profile_json:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('user_profile', ?)",
+                                   (profile_json,))
+                self._profile_json = profile_json
+
+    def _save_all(self, tasks, habits):
+        # Полная запись: обновляем все строки и удаляем из базы то, чего больше нет в модели
+        task_ids = set()
+        for task in tasks:
+            task_ids.add(task.id)
+            self._upsert_task(task)
+        self._delete_tasks([task_id for (task_id,) in self._conn.execute("SELECT id FROM tasks")
+                            if task_id not in task_ids])
+
+        habit_ids = set()
+        for habit in habits:
+            habit_ids.add(habit.id)
+            self._upsert_habit(habit)
+        self._delete_habits([habit_id for (habit_id,) in self._conn.execute("SELECT id FROM habits")
+                             if habit_id not in habit_ids])
+
+    def _delete_tasks(self, task_ids):
+        if task_ids:
+            self._conn.executemany("DELETE FROM tasks WHERE id = ?", [(task_id,) for task_id in task_ids])
+
+    def _delete_habits(self, habit_ids):
+        if habit_ids:
+            removed = [(habit_id,) for habit_id in habit_ids]
+            self._conn.executemany("DELETE FROM habits WHERE id = ?", removed)
+            self._conn.executemany("DELETE FROM habit_completions WHERE habit_id = ?", removed)
+
+    def _upsert_task(self, task):
+        self._conn.execute(self.UPSERT_TASK, self._task_row(task))
+
+    def _upsert_habit(self, habit):
+        self._conn.execute(self.UPSERT_HABIT, self._habit_row(habit))
+
+        # Отметки сравниваем с базой: в памяти копия записанного состояния не хранится
+        old_days = {day for (day,) in self._conn.execute(
+            "SELECT day FROM habit_completions WHERE habit_id = ?", (habit.id,))}
+        new_days = set(habit.completed_dates)
+        if new_days != old_days:
+            self._conn.executemany("INSERT OR IGNORE INTO habit_completions (habit_id, day) VALUES (?, ?)",
+                                   [(habit.id, day) for day in new_days - old_days])
+            self._conn.executemany("DELETE FROM habit_completions WHERE habit_id = ? AND day = ?",
+                                   [(habit.id, day) for day in old_days - new_days])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- Импорт и экспорт: CSV, JSON Lines и iCalendar (VTODO) ---
+HABIT_FREQUENCIES = ("daily", "weekly", "monthly")
+IMPORT_BATCH_SIZE = 2000  # Записей на одно обновление модели при импорте
+EXPORT_BATCH_SIZE = 5000  # Записей за один шаг цикла Tk при экспорте
+CSV_FIELDS = ["type", "id", "description", "due_date", "completed", "completed_on",
+              "frequency", "goal", "completed_dates"]
+TRANSFER_FILETYPES = [("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("iCalendar", "*.ics")]
+
+
+def record_text(record, key):
+    value = record.get(key)
+    return "" if value is None else str(value).strip()
+
+
+def record_date(record, key):
+    text = record_text(record, key)
+    try:
+        return parse_date(text) if text else None
+    except ValueError:
+        raise ValueError(f"некорректная дата в поле {key}: {text!r}") from None
+
+
+def record_bool(record, key):
+    value = record.get(key)
+    if isinstance(value, bool):
+        return value
+    text = record_text(record, key).lower()
+    if text in ("1", "true", "yes", "да"):
+        return True
+    if text in ("", "0", "false", "no", "нет"):
+        return False
+    raise ValueError(f"некорректное значение в поле {key}: {text!r}")
+
+
+def item_from_record(record):
+    # Задача или привычка из записи файла импорта. Строка JSON Lines разбирается здесь же.
+    # Некорректная запись - ValueError с описанием причины
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"некорректный JSON: {e.msg}") from None
+    if not isinstance(record, dict):
+        raise ValueError("ожидался объект")
+    kind = record_text(record, "type").lower() or "task"
+    description = record_text(record, "description")
+    if not description:
+        raise ValueError("пустое описание")
+    item_id = record_text(record, "id") or None
+    if kind == "task":
+        due_date = record_date(record, "due_date")
+        if due_date is None:
+            raise ValueError("не указан срок")
+        completed = record_bool(record, "completed")
+        completed_on = record_date(record, "completed_on") if completed else None
+        return Task(description, due_date, completed, item_id, completed_on)
+    if kind == "habit":
+        frequency = record_text(record, "frequency").lower()
+        if frequency not in HABIT_FREQUENCIES:
+            raise ValueError(f"неизвестная частота: {frequency!r}")
+        dates = record.get("completed_dates") or ()
+        if isinstance(dates, str):
+            dates = dates.split(";")
+        try:
+            days = [parse_date(str(day).strip()) for day in dates if str(day).strip()]
+        except ValueError:
+            raise ValueError("некорректная дата в поле completed_dates") from None
+        return Habit(description, frequency, record_text(record, "goal"), days, item_id)
+    raise ValueError(f"неизвестный тип записи: {kind!r}")
+
+
+def iter_text_lines(f):
+    # Строки бинарного файла как текст: по f.tell() видно, какая часть файла уже прочитана
+    for i, line in enumerate(f):
+        text = line.decode("utf-8")
+        yield text.lstrip("\ufeff") if i == 0 else text
+
+
+class EchoWriter:
+    # Приемник для csv.writer: writerow возвращает готовую строку вместо записи в файл
+    def write(self, value):
+        return value
+
+
+def read_csv_records(lines):
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def write_csv_records(tasks, habits):
+    writer = csv.writer(EchoWriter())
+    yield writer.writerow(CSV_FIELDS)
+    for task in tasks:
+        yield writer.writerow(["task", task.id, task.description, task.due_date.strftime("%Y-%m-%d"),
+                               int(task.completed),
+                               task.completed_on.strftime("%Y-%m-%d") if task.completed_on else "", "", "", ""])
+    for habit in habits:
+        yield writer.writerow(["habit", habit.id, habit.description, "", "", "", habit.frequency, habit.goal,
+                               ";".join(habit.completed_dates)])
+
+
+def read_jsonl_records(lines):
+    for line_number, line in enumerate(lines, 1):
+        if line.strip():
+            yield line_number, line
+
+
+def write_jsonl_records(tasks, habits):
+    for task in tasks:
+        yield json.dumps(dict(type="task", **task.to_dict()), ensure_ascii=False) + "\n"
+    for habit in habits:
+        data = habit.to_dict()
+        data["completed_dates"] = list(habit.completed_dates)
+        yield json.dumps(dict(type="habit", **data), ensure_ascii=False) + "\n"
+
+
+ICAL_PROPERTY_RE = re.compile(r'([^:;]+)((?:;[^:;=]+=(?:"[^"]*"|[^:;"]*))*):(.*)')
+
+
+def ical_escape(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def ical_unescape(text):
+    return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) in "nN" else m.group(1), text)
+
+
+def ical_fold(line):
+    # Строки длиннее 75 байт переносятся с пробелом в начале продолжения, не разрывая символы UTF-8
+    data = line.encode("utf-8")
+    parts = []
+    limit = 75
+    while len(data) > limit:
+        cut = limit
+        while data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode("utf-8"))
+        data = data[cut:]
+        limit = 74
+    parts.append(data.decode("utf-8"))
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def ical_date(value):
+    # "20240131" или "20240131T090000Z" -> "2024-01-31"; остальное возвращается как есть и не пройдет проверку
+    if len(value) >= 8 and value[:8].isdigit():
+        return f"{value[:4]}-{value[4:6]}-{value[6:8]}"
+    return value
+
+
+def read_ical_records(lines):
+    # Свойства каждого VTODO собираются в словарь; строки-продолжения склеиваются с предыдущей
+    def unfolded():
+        current, start = None, 0
+        for line_number, line in enumerate(lines, 1):
+            line = line.rstrip("\r\n")
+            if line[:1] in (" ", "\t") and current is not None:
+                current += line[1:]
+                continue
+            if current is not None:
+                yield start, current
+            current, start = line, line_number
+        if current is not None:
+            yield start, current
+
+    properties, start = None, 0
+    for line_number, line in unfolded():
+        match = ICAL_PROPERTY_RE.match(line)
+        if not match:
+            continue
+        name, value = match.group(1).upper(), match.group(3)
+        if name == "BEGIN" and value.upper() == "VTODO":
+            properties, start = {}, line_number
+        elif name == "END" and value.upper() == "VTODO" and properties is not None:
+            yield start, ical_record(properties)
+            properties = None
+        elif properties is not None:
+            properties.setdefault(name, value)
+
+
+def ical_record(properties):
+    record = {"id": properties.get("UID"), "description": ical_unescape(properties.get("SUMMARY", ""))}
+    rrule = properties.get("RRULE")
+    if rrule:
+        rule = dict(part.split("=", 1) for part in rrule.split(";") if "=" in part)
+        done = properties.get("X-TASKMANAGER-DONE", "")
+        record.update(type="habit", frequency=rule.get("FREQ", "").lower(),
+                      goal=ical_unescape(properties.get("DESCRIPTION", "")),
+                      completed_dates=[ical_date(day) for day in done.split(",") if day])
+    else:
+        record.update(type="task", due_date=ical_date(properties.get("DUE", "")),
+                      completed=properties.get("STATUS", "").upper() == "COMPLETED",
+                      completed_on=ical_date(properties.get("COMPLETED", "")))
+    return record
+
+
+def write_ical_records(tasks, habits):
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Менеджер задач и привычек//RU\r\n"
+    for task in tasks:
+        lines = ["BEGIN:VTODO", f"UID:{task.id}", f"DTSTAMP:{stamp}", f"SUMMARY:{ical_escape(task.description)}",
+                 f"DUE;VALUE=DATE:{task.due_date.strftime('%Y%m%d')}",
+                 f"STATUS:{'COMPLETED' if task.completed else 'NEEDS-ACTION'}"]
+        if task.completed_on:
+            lines.append(f"COMPLETED:{task.completed_on.strftime('%Y%m%d')}T000000Z")
+        lines.append("END:VTODO")
+        yield "".join(ical_fold(line) for line in lines)
+    for habit in habits:
+        # Привычка - повторяющаяся задача; дни выполнения хранятся в собственном свойстве
+        lines = ["BEGIN:VTODO", f"UID:{habit.id}", f"DTSTAMP:{stamp}", f"SUMMARY:{ical_escape(habit.description)}",
+                 f"RRULE:FREQ={habit.frequency.upper()}"]
+        if habit.goal:
+            lines.append(f"DESCRIPTION:{ical_escape(habit.goal)}")
+        if len(habit.completed_dates):
+            lines.append("X-TASKMANAGER-DONE:" + ",".join(day.strftime("%Y%m%d")
+                                                           for day in habit.completed_dates.days()))
+        lines.append("END:VTODO")
+        yield "".join(ical_fold(line) for line in lines)
+    yield "END:VCALENDAR\r\n"
+
+
+TRANSFER_FORMATS = {
+    ".csv": (read_csv_records, write_csv_records),
+    ".jsonl": (read_jsonl_records, write_jsonl_records),
+    ".ics": (read_ical_records, write_ical_records),
+}
+
+
+def transfer_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in TRANSFER_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат файла: {extension or path}")
+    return TRANSFER_FORMATS[extension]
+
+
+def import_batches(path, batch_size=IMPORT_BATCH_SIZE):
+    # Потоковый импорт: порции (задачи, привычки, ошибки, доля прочитанного), ошибки - пары (строка, причина).
+    # В памяти одновременно только одна порция
+    read, _ = transfer_format(path)
+    size = os.path.getsize(path) or 1
+    with open(path, "rb") as f:
+        tasks, habits, errors = [], [], []
+        for line_number, record in read(iter_text_lines(f)):
+            try:
+                item = item_from_record(record)
+            except (ValueError, TypeError) as e:
+                errors.append((line_number, str(e)))
+            else:
+                (habits if isinstance(item, Habit) else tasks).append(item)
+            if len(tasks) + len(habits) + len(errors) >= batch_size:
+                yield tasks, habits, errors, f.tell() / size
+                tasks, habits, errors = [], [], []
+        yield tasks, habits, errors, 1.0
+
+
+def export_items(path, tasks, habits, batch_size=EXPORT_BATCH_SIZE):
+    # Генератор: пишет файл по одной записи и после каждых batch_size записей отдает долю готового.
+    # Файл подменяется целиком в конце, недописанный экспорт не портит прежний файл
+    _, write = transfer_format(path)
+    total = len(tasks) + len(habits) or 1
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        for written, chunk in enumerate(write(tasks, habits)):
+            f.write(chunk)
+            if written and written % batch_size == 0:
+                yield min(written / total, 1.0)
+    os.replace(tmp_path, path)
+    yield 1.0
+
+
+TASK_REMINDER_TIME = datetime.time(9, 0)  # Когда напоминать о задаче в день срока
+HABIT_REMINDER_TIME = datetime.time(20, 0)  # Когда напоминать о невыполненной привычке в конце периода
+REMINDER_BATCH_SIZE = 500  # Сколько сработавших напоминаний разбирать за один проход цикла Tk
+
+
+def habit_period_start(frequency, day):
+    if frequency == "weekly":
+        return day - datetime.timedelta(days=day.weekday())
+    if frequency == "monthly":
+        return day.replace(day=1)
+    return day
+
+
+def habit_period_end(frequency, day):
+    if frequency == "weekly":
+        return day + datetime.timedelta(days=6 - day.weekday())
+    if frequency == "monthly":
+        next_month = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        return next_month - datetime.timedelta(days=1)
+    return day
+
+
+def habit_done_in_period(habit, day):
+    return habit.completed_dates.any_between(habit_period_start(habit.frequency, day),
+                                             habit_period_end(habit.frequency, day))
+
+
+def habit_period_index(frequency, ordinal):
+    # Номер периода привычки, содержащего день с данным порядковым номером
+    if frequency == "weekly":
+        return (ordinal - 1) // 7  # День с номером 1 (0001-01-01) - понедельник
+    if frequency == "monthly":
+        day = datetime.date.fromordinal(ordinal)
+        return day.year * 12 + day.month - 1
+    return ordinal
+
+
+def habit_period_flags(habit, today=None):
+    # Выполнение по периодам привычки от первого отмеченного до текущего: (номер первого периода, флаги)
+    today = today or datetime.date.today()
+    bitmap = habit.completed_dates
+    last_period = habit_period_index(habit.frequency, today.toordinal())
+    if not len(bitmap):
+        return last_period, []
+    if load_numpy():
+        days = np.unpackbits(np.frombuffer(bytes(bitmap.bits), dtype=np.uint8), bitorder="little")
+        ordinals = np.flatnonzero(days) + bitmap.start
+        ordinals = ordinals[ordinals <= today.toordinal()]
+        if habit.frequency == "weekly":
+            periods = (ordinals - 1) // 7
+        elif habit.frequency == "monthly":
+            dates = (ordinals - EPOCH_ORDINAL).astype("datetime64[D]")
+            periods = dates.astype("datetime64[M]").astype(np.int64) + 1970 * 12
+        else:
+            periods = ordinals
+        if not len(periods):
+            return last_period, []
+        first_period = int(periods[0])
+        flags = np.zeros(last_period - first_period + 1, dtype=bool)
+        flags[periods - first_period] = True
+        return first_period, flags
+    periods = sorted({habit_period_index(habit.frequency, ordinal)
+                      for ordinal in bitmap.ordinals() if ordinal <= today.toordinal()})
+    if not periods:
+        return last_period, []
+    flags = [False] * (last_period - periods[0] + 1)
+    for period in periods:
+        flags[period - periods[0]] = True
+    return periods[0], flags
+
+
+def habit_streaks(habit, today=None):
+    # Текущая и самая длинная серия подряд выполненных периодов.
+    # Текущий период еще не закончен, поэтому его пропуск серию не прерывает
+    _, flags = habit_period_flags(habit, today)
+    if not len(flags):
+        return 0, 0
+    if load_numpy():
+        padded = np.concatenate(([0], np.asarray(flags, dtype=np.int8), [0]))
+        edges = np.diff(padded)
+        runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+        longest = int(runs.max()) if len(runs) else 0
+        done = flags if flags[-1] else flags[:-1]
+        missed = np.flatnonzero(~np.asarray(done, dtype=bool))
+        current = len(done) - (int(missed[-1]) + 1 if len(missed) else 0)
+        return current, longest
+    longest = run = 0
+    for flag in flags:
+        run = run + 1 if flag else 0
+        longest = max(longest, run)
+    done = flags if flags[-1] else flags[:-1]
+    current = 0
+    for flag in reversed(done):
+        if not flag:
+            break
+        current += 1
+    return current, longest
+
+
+def habit_completion_rate(habit, window, today=None):
+    # Доля выполненных периодов привычки за текущую неделю или месяц (window = "week" / "month").
+    # Для недельной привычки за месяц считаются недели, начинающиеся в этом месяце; None - периодов нет
+    today = today or datetime.date.today()
+    if window == "week":
+        first_day = today - datetime.timedelta(days=today.weekday())
+    else:
+        first_day = today.replace(day=1)
+    period_starts = []
+    day = first_day
+    while day <= today:
+        if habit_period_start(habit.frequency, day) == day:
+            period_starts.append(day)
+        day += datetime.timedelta(days=1)
+    if not period_starts:
+        return None
+    done = sum(1 for start in period_starts
+               if habit.completed_dates.any_between(start, habit_period_end(habit.frequency, start)))
+    return done / len(period_starts)
+
+
+def habit_recent_streak(habit, limit, today=None):
+    # Текущая серия выполненных периодов, но не длиннее limit: просматриваются только последние limit периодов,
+    # так что цена не зависит от длины истории. Неотмеченный текущий период серию не прерывает
+    day = today or datetime.date.today()
+    if not habit_done_in_period(habit, day):
+        day = habit_period_start(habit.frequency, day) - datetime.timedelta(days=1)
+    streak = 0
+    while streak < limit and habit_done_in_period(habit, day):
+        streak += 1
+        day = habit_period_start(habit.frequency, day) - datetime.timedelta(days=1)
+    return streak
+
+
+def habit_occurrences(habit, first, last):
+    # Ленивое развертывание повторений привычки: (последний день периода, выполнен ли период) для периодов,
+    # заканчивающихся в first..last. Перебираются только периоды окна, история до и после не затрагивается
+    day = first
+    while True:
+        end = habit_period_end(habit.frequency, day)
+        if end > last:
+            return
+        yield end, habit.completed_dates.any_between(habit_period_start(habit.frequency, day), end)
+        day = end + datetime.timedelta(days=1)
+
+
+# --- Календарь ---
+CalendarDay = collections.namedtuple("CalendarDay", "day tasks_due tasks_open tasks_done habits_done habits")
+MONTH_NAMES = ("Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+               "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь")
+WEEKDAY_NAMES = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+CALENDAR_WEEK_TASKS = 8  # Сколько задач дня перечислять в ячейке недельного вида
+CALENDAR_DAY_TASKS = 200  # Сколько задач показывать в подробностях выбранного дня
+CALENDAR_LAST_WEEK_DAY = datetime.date(9999, 12, 26)  # Воскресенье последней недели, целиком помещающейся в date
+
+
+# --- Квесты ---
+# Определения квестов берутся из quests.json (список объектов), без файла - из DEFAULT_QUESTS. Поля:
+# id, type, description, amount, reward; необязательные: deadline_days - сколько дней дается на квест,
+# frequency - только привычки с этой частотой, on_time - только задачи, выполненные не позже срока
+QUESTS_FILE = "quests.json"
+MAX_ACTIVE_QUESTS = 3
+QUEST_EVENTS = {  # Тип квеста -> событие, на которое он подписан
+    "complete_tasks": "task_completed",
+    "complete_habits": "habit_marked",
+    "habit_streak": "habit_marked",
+}
+DEFAULT_QUESTS = [
+    {"id": "tasks_3", "type": "complete_tasks", "description": "Выполните 3 задачи", "amount": 3, "reward": 50},
+    {"id": "habit_today", "type": "complete_habits", "description": "Отметьте выполнение хотя бы одной привычки сегодня",
+     "amount": 1, "reward": 30, "deadline_days": 1},
+    {"id": "tasks_on_time_10", "type": "complete_tasks", "description": "Выполните 10 задач в срок за неделю",
+     "amount": 10, "reward": 100, "deadline_days": 7, "on_time": True},
+    {"id": "weekly_habits_3", "type": "complete_habits", "description": "Отметьте еженедельные привычки 3 раза за месяц",
+     "amount": 3, "reward": 60, "deadline_days": 30, "frequency": "weekly"},
+    {"id": "daily_streak_7", "type": "habit_streak", "description": "Выполняйте ежедневную привычку 7 дней подряд",
+     "amount": 7, "reward": 150, "frequency": "daily"},
+]
+
+
+def validate_quest(definition):
+    # Проверенное определение квеста или ValueError
+    if not isinstance(definition, dict):
+        raise ValueError("ожидался объект")
+    for key in ("id", "type", "description"):
+        if not isinstance(definition.get(key), str) or not definition[key]:
+            raise ValueError(f"нет поля {key}")
+    if definition["type"] not in QUEST_EVENTS:
+        raise ValueError(f"неизвестный тип {definition['type']!r}")
+    for key in ("amount", "reward"):
+        if not isinstance(definition.get(key), int) or definition[key] < 0:
+            raise ValueError(f"некорректное поле {key}")
+    deadline_days = definition.get("deadline_days")
+    if deadline_days is not None and (not isinstance(deadline_days, int) or deadline_days < 1):
+        raise ValueError("некорректное поле deadline_days")
+    if definition.get("frequency") not in (None, *HABIT_FREQUENCIES):
+        raise ValueError("некорректное поле frequency")
+    return definition
+
+
+class QuestEngine:
+    # Активные квесты и их прогресс. Каждый активный квест подписан на событие своего типа, поэтому событие
+    # затрагивает только ждущие его квесты, а сроки проверяются по куче - без просмотра истории и всех квестов.
+    # Состояние квеста: {"id", "progress", "assigned_on", "deadline", "counted"} (даты - "ГГГГ-ММ-ДД"), хранится
+    # в профиле. counted - уже засчитанные задачи и периоды привычек: повторная отметка того же не дает прогресса
+    def __init__(self, definitions):
+        self.definitions = {definition["id"]: definition for definition in definitions}
+        self.load_state([])
+
+    def load_state(self, states):
+        self.active = {}  # id -> состояние
+        self.listeners = collections.defaultdict(dict)  # Событие -> {id: состояние}
+        self._deadlines = []  # Куча (порядковый номер последнего дня, id)
+        for state in states:
+            if state.get("id") in self.definitions:
+                self._add(dict(state))
+
+    def state(self):
+        # Копия состояний для сохранения в профиле
+        return [dict(state) for state in self.active.values()]
+
+    def _add(self, state):
+        definition = self.definitions[state["id"]]
+        self.active[state["id"]] = state
+        self.listeners[QUEST_EVENTS[definition["type"]]][state["id"]] = state
+        if state.get("deadline"):
+            heapq.heappush(self._deadlines, (parse_date(state["deadline"]).toordinal(), state["id"]))
+
+    def remove(self, quest_id):
+        state = self.active.pop(quest_id)
+        del self.listeners[QUEST_EVENTS[self.definitions[quest_id]["type"]]][quest_id]
+        return state
+
+    def activate(self, quest_id, today):
+        deadline_days = self.definitions[quest_id].get("deadline_days")
+        deadline = today + datetime.timedelta(days=deadline_days - 1) if deadline_days else None
+        self._add({"id": quest_id, "progress": 0, "assigned_on": today.strftime("%Y-%m-%d"),
+                   "deadline": deadline.strftime("%Y-%m-%d") if deadline else None})
+        return self.definitions[quest_id]
+
+    def available(self):
+        return [quest_id for quest_id in self.definitions if quest_id not in self.active]
+
+    def progress(self):
+        # [(определение, прогресс)] активных квестов
+        return [(self.definitions[quest_id], state["progress"]) for quest_id, state in self.active.items()]
+
+    def expire(self, today):
+        # Снимает квесты с истекшим сроком, возвращает их определения
+        expired = []
+        limit = today.toordinal()
+        while self._deadlines and self._deadlines[0][0] < limit:
+            deadline, quest_id = heapq.heappop(self._deadlines)
+            state = self.active.get(quest_id)
+            if state and state["deadline"] and parse_date(state["deadline"]).toordinal() == deadline:
+                self.remove(quest_id)
+                expired.append(self.definitions[quest_id])
+        return expired
+
+    def notify(self, event, today, task=None, habit=None):
+        # Обновляет прогресс подписанных на событие квестов: (изменился ли прогресс, выполненные определения)
+        changed = False
+        completed = []
+        for quest_id, state in list(self.listeners[event].items()):
+            definition = self.definitions[quest_id]
+            if definition.get("frequency") and habit is not None and habit.frequency != definition["frequency"]:
+                continue
+            if definition.get("on_time") and task is not None and task.completed_on > task.due_date:
+                continue
+            if definition["type"] == "habit_streak":
+                progress = max(state["progress"], habit_recent_streak(habit, definition["amount"], today))
+            else:
+                if task is not None:
+                    key = task.id
+                else:
+                    key = f"{habit.id}:{habit_period_start(habit.frequency, today).strftime('%Y-%m-%d')}"
+                counted = state.get("counted") or []
+                if key in counted:
+                    continue
+                # Новый список, а не append: копии состояния в профиле и истории отмены делят его с этим
+                state["counted"] = counted + [key]
+                progress = state["progress"] + 1
+            if progress != state["progress"]:
+                state["progress"] = progress
+                changed = True
+            if progress >= definition["amount"]:
+                self.remove(quest_id)
+                completed.append(definition)
+        return changed, completed
+
+
+class ReminderScheduler:
+    # Очередь напоминаний с приоритетом по времени срабатывания: поток спит ровно до ближайшего
+    MAX_SLEEP = 600  # Периодически просыпаемся на случай перевода часов или сна системы
+
+    def __init__(self, callback):
+        self.callback = callback  # Вызывается из потока планировщика с ключом сработавшего напоминания
+        self._heap = []
+        self._entries = {}  # Ключ -> актуальная запись в куче, остальные записи считаются отмененными
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def schedule(self, key, when):
+        # Добавляет или переносит напоминание, O(log n)
+        with self._cond:
+            entry = (when.timestamp(), next(self._seq), key)
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify()
+            self._compact()
+
+    def cancel(self, key):
+        with self._cond:
+            self._entries.pop(key, None)
+            self._compact()
+
+    def reset(self, items):
+        # Полная перестройка по парам (ключ, время), O(n)
+        with self._cond:
+            self._heap = [(when.timestamp(), next(self._seq), key) for key, when in items]
+            heapq.heapify(self._heap)
+            self._entries = {entry[2]: entry for entry in self._heap}
+            self._cond.notify()
+
+    def _compact(self):
+        # Отмененные записи удаляются лениво; чистим кучу, когда их стало слишком много
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._entries.get(self._heap[0][2]) is not self._heap[0]:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        entry = heapq.heappop(self._heap)
+                        del self._entries[entry[2]]
+                        break
+                    self._cond.wait(min(delay, self.MAX_SLEEP))
+            try:
+                self.callback(entry[2])
+            except Exception as e:
+                print(f"Ошибка при обработке напоминания: {e}")
+
+
+class BackgroundSaver:
+    # Отложенная запись в фоновом потоке: запросы сохранения в пределах окна объединяются в одну запись
+    def __init__(self, save_func, window=0.5):
+        self.save_func = save_func
+        self.window = window  # Окно объединения, секунды
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()  # Запись идет строго по одной
+        self._dirty = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request_save(self):
+        with self._cond:
+            self._dirty = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._dirty or self._stopped)
+                if self._stopped:
+                    return
+                # Ждем окно, собирая последующие запросы; остановка прерывает ожидание
+                self._cond.wait_for(lambda: self._stopped, timeout=self.window)
+            self.flush()
+
+    def flush(self):
+        with self._io_lock:
+            with self._cond:
+                if not self._dirty:
+                    return
+                self._dirty = False
+            try:
+                self.save_func()
+            except Exception as e:
+                print(f"Ошибка фонового сохранения: {e}")
+
+    def stop(self):
+        # Дописываем все, что накопилось, и завершаем поток
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+
+# Уведомление о сработавшем напоминании. kind: "overdue", "due" или "habit"; day - день, за который оно выдано
+Notification = collections.namedtuple("Notification", "kind item_id day description title message")
+
+
+def plural(count, one, few, many):
+    # Форма слова для числа: 1 задача, 3 задачи, 12 задач
+    if count % 10 == 1 and count % 100 != 11:
+        return one
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return few
+    return many
+
+
+class NotificationQueue:
+    # Доставка уведомлений в фоновом потоке. Повтор уведомления о том же объекте за тот же день отбрасывается,
+    # накопившиеся уведомления объединяются в одну сводку, сводки выдаются не чаще раза в min_interval секунд.
+    # Сколько бы напоминаний ни сработало, пользователь получает одно уведомление за интервал
+    DIGEST_PREVIEW = 3  # Сколько названий перечислять в сводке
+
+    def __init__(self, deliver, window=1.0, min_interval=60.0):
+        self.deliver = deliver  # Вызывается из потока очереди с заголовком и текстом
+        self.window = window  # Окно сбора уведомлений в сводку, секунды
+        self.min_interval = min_interval
+        self._cond = threading.Condition()
+        self._pending = {}  # Вид -> [число, первые уведомления для показа]
+        self._seen = set()  # (вид, id) уже принятых уведомлений за день _seen_day
+        self._seen_day = None
+        self._last_delivery = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def push(self, notification):
+        # Возвращает False, если такое уведомление за этот день уже было
+        with self._cond:
+            if notification.day != self._seen_day:
+                self._seen = set()
+                self._seen_day = notification.day
+            key = (notification.kind, notification.item_id)
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+            pending = self._pending.setdefault(notification.kind, [0, []])
+            pending[0] += 1
+            if len(pending[1]) < self.DIGEST_PREVIEW:
+                pending[1].append(notification)
+            self._cond.notify()
+            return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopped)
+                if self._stopped:
+                    return
+                delay = self.window
+                if self._last_delivery is not None:
+                    delay = max(delay, self._last_delivery + self.min_interval - time.monotonic())
+                self._cond.wait_for(lambda: self._stopped, timeout=delay)
+                if self._stopped:
+                    return
+                pending, self._pending = self._pending, {}
+                self._last_delivery = time.monotonic()
+            try:
+                self.deliver(*self.digest(pending))
+            except Exception as e:
+                print(f"Ошибка при показе уведомления: {e}")
+
+    @classmethod
+    def digest(cls, pending):
+        # Заголовок и текст одной сводки по накопленным уведомлениям
+        if len(pending) == 1:
+            (kind, (count, preview)), = pending.items()
+            if count == 1:
+                return preview[0].title, preview[0].message
+        lines = []
+        title = "Напоминания"
+        for kind, (count, preview) in pending.items():
+            names = ", ".join(f"'{notification.description}'" for notification in preview)
+            if count > len(preview):
+                names += f" и еще {count - len(preview)}"
+            if kind == "overdue":
+                title = "Задачи просрочены!"
+                lines.append(f"{count} {plural(count, 'задача', 'задачи', 'задач')} "
+                             f"{plural(count, 'просрочена', 'просрочены', 'просрочено')}: {names}")
+            elif kind == "due":
+                title = "Задачи на сегодня!"
+                lines.append(f"{count} {plural(count, 'задача', 'задачи', 'задач')} на сегодня: {names}")
+            else:
+                title = "Привычки!"
+                lines.append(f"Не забудьте отметить {plural(count, 'привычку', 'привычки', 'привычки')} "
+                             f"({count}): {names}")
+        if len(lines) > 1:
+            title = "Напоминания"
+        return title, "\n".join(lines)
+
+    def stop(self):
+        # Неотправленные уведомления при выходе отбрасываются
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+
+class VirtualListView(ttk.Frame):
+    # Виртуальный список: в Treeview существуют только видимые строки, строки адресуются стабильными id.
+    # format_rows(first_index, ids) возвращает тексты для подряд идущих строк.
+    # В режиме selectmode="extended" выделение (Ctrl и Shift) хранится по id и переживает прокрутку
+    DEFAULT_ROW_HEIGHT = 20
+
+    def __init__(self, master, format_rows, height=10, selectmode="browse"):
+        super().__init__(master)
+        self.format_rows = format_rows
+        self.ids = []
+        self.positions = {}  # id -> позиция в списке
+        self.first = 0  # Индекс первой видимой строки
+        self.visible_count = height
+        self.selectmode = selectmode
+        self.selected_id = None  # Последняя выбранная строка, от нее отсчитывается диапазон с Shift
+        self.selected_ids = set()
+
+        self.tree = ttk.Treeview(self, show="tree", height=height, selectmode=selectmode)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_to(self.first + (-3 if e.delta > 0 else 3)))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_to(self.first - 3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_to(self.first + 3))
+        if selectmode == "extended":
+            # Встроенное выделение Treeview видит только существующие строки, поэтому щелчки обрабатываем сами
+            self.tree.bind("<Button-1>", self.on_click)
+            self.tree.bind("<Control-a>", self.select_all)
+
+    def row_height(self):
+        try:
+            return int(ttk.Style().lookup("Treeview", "rowheight")) or self.DEFAULT_ROW_HEIGHT
+        except (ValueError, tk.TclError):
+            return self.DEFAULT_ROW_HEIGHT
+
+    def bind_activate(self, callback):
+        self.tree.bind("<Double-Button-1>", callback)
+        self.tree.bind("<Return>", callback)
+
+    def set_items(self, ids, first=None):
+        # Полная замена содержимого, например после загрузки данных; first - к какой строке прокрутить
+        self.ids = list(ids)
+        if first is not None:
+            self.first = first
+        self.positions = {item_id: i for i, item_id in enumerate(self.ids)}
+        if self.selected_id not in self.positions:
+            self.selected_id = None
+        self.selected_ids = {item_id for item_id in self.selected_ids if item_id in self.positions}
+        self.render()
+
+    def append(self, item_id):
+        self.positions[item_id] = len(self.ids)
+        self.ids.append(item_id)
+        if self.first <= self.positions[item_id] < self.first + self.visible_count:
+            self.render()
+        else:
+            self.update_scrollbar()
+
+    def refresh(self, item_id):
+        # Перерисовка одной строки, если она сейчас видна
+        if self.tree.exists(item_id):
+            position = self.positions[item_id]
+            self.tree.item(item_id, text=self.format_rows(position, [item_id])[0])
+
+    def refresh_visible(self):
+        self.render()
+
+    def selection(self):
+        return self.selected_id
+
+    def selected(self):
+        # Все выбранные id в порядке списка
+        if self.selectmode != "extended":
+            return [self.selected_id] if self.selected_id is not None else []
+        return sorted(self.selected_ids, key=self.positions.__getitem__)
+
+    def on_click(self, event):
+        item_id = self.tree.identify_row(event.y)
+        if not item_id:
+            return
+        if event.state & 0x0001 and self.selected_id in self.positions:  # Shift - диапазон, в том числе за экраном
+            start, end = sorted((self.positions[self.selected_id], self.positions[item_id]))
+            self.selected_ids = set(self.ids[start:end + 1])
+        elif event.state & 0x0004:  # Ctrl - добавить или убрать строку
+            self.selected_ids ^= {item_id}
+            self.selected_id = item_id
+        else:
+            self.selected_ids = {item_id}
+            self.selected_id = item_id
+        self.tree.focus_set()
+        self.tree.focus(item_id)
+        self.apply_selection()
+        return "break"
+
+    def select_all(self, event=None):
+        self.selected_ids = set(self.ids)
+        self.apply_selection()
+        return "break"
+
+    def apply_selection(self):
+        # Показывает выделение на видимых строках
+        visible = [iid for iid in self.tree.get_children() if iid in self.selected_ids]
+        if set(self.tree.selection()) != set(visible):
+            self.tree.selection_set(visible)
+
+    def scroll_to(self, first):
+        first = max(0, min(first, len(self.ids) - self.visible_count))
+        if first != self.first:
+            self.first = first
+            self.render()
+
+    def render(self):
+        self.first = max(0, min(self.first, len(self.ids) - self.visible_count))
+        visible = self.ids[self.first:self.first + self.visible_count]
+        texts = self.format_rows(self.first, visible) if visible else []
+        wanted = set(visible)
+        stale = [iid for iid in self.tree.get_children() if iid not in wanted]
+        if stale:
+            self.tree.delete(*stale)
+        for index, (item_id, text) in enumerate(zip(visible, texts)):
+            if self.tree.exists(item_id):
+                if self.tree.item(item_id, "text") != text:
+                    self.tree.item(item_id, text=text)
+                if self.tree.index(item_id) != index:
+                    self.tree.move(item_id, "", index)
+            else:
+                self.tree.insert("", index, iid=item_id, text=text)
+        if self.selectmode == "extended":
+            self.apply_selection()
+        elif self.selected_id in wanted and self.tree.selection() != (self.selected_id,):
+            self.tree.selection_set(self.selected_id)
+        self.update_scrollbar()
+
+    def update_scrollbar(self):
+        total = len(self.ids)
+        if total <= self.visible_count:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.first / total, (self.first + self.visible_count) / total)
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.ids)))
+        elif unit == "pages":
+            self.scroll_to(self.first + int(amount) * self.visible_count)
+        else:
+            self.scroll_to(self.first + int(amount))
+
+    def on_resize(self, event):
+        visible_count = max(1, event.height // self.row_height())
+        if visible_count != self.visible_count:
+            self.visible_count = visible_count
+            self.render()
+
+    def on_select(self, event=None):
+        selection = self.tree.selection()
+        if self.selectmode == "extended":
+            # Выделение с клавиатуры меняет только видимые строки, выбранные за экраном сохраняются
+            self.selected_ids.difference_update(self.tree.get_children())
+            self.selected_ids.update(selection)
+            if self.tree.focus() in self.selected_ids:
+                self.selected_id = self.tree.focus()
+        elif selection:
+            self.selected_id = selection[0]
+
+
+class Statistics:
+    # Агрегаты по задачам и привычкам, обновляются за O(1) при каждом изменении
+    def __init__(self):
+        self.reset([], [])
+
+    def reset(self, tasks, habits):
+        # Полный пересчет, нужен только после загрузки данных
+        self.tasks_total = 0
+        self.tasks_completed = 0
+        self.open_by_due = collections.Counter()  # Срок -> число невыполненных задач
+        self.task_completions_by_day = collections.Counter()
+        self.habit_completions_by_day = collections.Counter()
+        self.habit_completions_by_week = collections.Counter()  # (год, неделя ISO) -> отметки
+        self.habit_completions_by_month = collections.Counter()  # (год, месяц) -> отметки
+        self._overdue_day = datetime.date.today()
+        self._overdue = 0
+        for task in tasks:
+            self.task_added(task)
+        for habit in habits:
+            for day in habit.completed_dates.days():
+                self.habit_marked(day, 1)
+
+    @property
+    def tasks_open(self):
+        return self.tasks_total - self.tasks_completed
+
+    def overdue(self, today=None):
+        # Число невыполненных задач со сроком раньше сегодняшнего дня
+        today = today or datetime.date.today()
+        if today < self._overdue_day:
+            self._overdue = sum(count for due, count in self.open_by_due.items() if due < today)
+        else:
+            day = self._overdue_day
+            while day < today:
+                self._overdue += self.open_by_due[day]
+                day += datetime.timedelta(days=1)
+        self._overdue_day = today
+        return self._overdue
+
+    def due_on(self, day):
+        return self.open_by_due[day]
+
+    def task_added(self, task):
+        self.tasks_total += 1
+        if task.completed:
+            self.tasks_completed += 1
+            if task.completed_on:
+                self.task_completions_by_day[task.completed_on] += 1
+        else:
+            self._add_open(task.due_date, 1)
+
+    def task_removed(self, task):
+        self.tasks_total -= 1
+        if task.completed:
+            self.tasks_completed -= 1
+            if task.completed_on:
+                self.task_completions_by_day[task.completed_on] -= 1
+        else:
+            self._add_open(task.due_date, -1)
+
+    def task_completed(self, task):
+        self.tasks_completed += 1
+        self._add_open(task.due_date, -1)
+        self.task_completions_by_day[task.completed_on] += 1
+
+    def task_reopened(self, task, completed_on):
+        self.tasks_completed -= 1
+        self._add_open(task.due_date, 1)
+        if completed_on:
+            self.task_completions_by_day[completed_on] -= 1
+
+    def _add_open(self, due_date, delta):
+        self.open_by_due[due_date] += delta
+        if due_date < self._overdue_day:
+            self._overdue += delta
+
+    def habit_marked(self, day, delta):
+        # delta = 1 при отметке привычки за день, -1 при снятии отметки
+        if isinstance(day, str):
+            day = datetime.date.fromisoformat(day)
+        year, week, _ = day.isocalendar()
+        self.habit_completions_by_day[day] += delta
+        self.habit_completions_by_week[(year, week)] += delta
+        self.habit_completions_by_month[(day.year, day.month)] += delta
+
+
+AVATAR_SIZE = (100, 100)
+AVATAR_CACHE_DIR = ".avatar_cache"  # Готовые миниатюры аватарок
+
+
+class AvatarLoader:
+    # Декодирование аватарки в фоновом потоке. Миниатюра кэшируется на диске по пути, времени
+    # изменения и размеру файла, так что оригинал декодируется один раз
+    def __init__(self, cache_dir=AVATAR_CACHE_DIR, size=AVATAR_SIZE):
+        self.cache_dir = cache_dir
+        self.size = size
+
+    def cache_path(self, path):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{self.size[0]}x{self.size[1]}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+    def load_async(self, path, on_done, on_error):
+        # Колбэки вызываются из рабочего потока с готовым PIL-изображением или исключением
+        def work():
+            try:
+                image = self.load(path)
+            except Exception as e:
+                on_error(e)
+            else:
+                on_done(image)
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def load(self, path):
+        from PIL import Image
+
+        cache_path = self.cache_path(path)
+        if os.path.exists(cache_path):
+            image = Image.open(cache_path)
+            image.load()
+            return image
+
+        image = Image.open(path)
+        image.draft("RGB", self.size)  # JPEG уменьшается уже при декодировании
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image = image.resize(self.size, Image.Resampling.LANCZOS)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Свой временный файл на каждую загрузку: две одновременные загрузки одного пути не мешают друг другу
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            try:
+                image.save(f, format="PNG")
+            except BaseException:
+                f.close()
+                os.remove(tmp_path)
+                raise
+        os.replace(tmp_path, cache_path)
+        return image
+
+
+UNDO_HISTORY_BUDGET = 4 << 20  # Сколько байт операций держать для отмены и повтора
+JOURNAL_FILE = "data.journal"
+
+
+class History:
+    # Отмена и повтор на обратимых операциях вместо снимков данных. Операция - (вид, цель, было, стало)
+    # из JSON-совместимых значений; действие пользователя - список операций. Отмена применяет их в обратном
+    # порядке со значениями "было", повтор - в прямом со значениями "стало", так что цена пропорциональна
+    # размеру действия. Каждое действие, отмена и повтор дописываются строкой в журнал: после успешной записи
+    # в хранилище журнал обрезается по этой контрольной точке, а при загрузке оставшиеся записи применяются заново
+    def __init__(self, journal_path=None, budget=UNDO_HISTORY_BUDGET):
+        self.journal_path = journal_path
+        self.budget = budget
+        self.undo_stack = collections.deque()  # (название, операции, размер)
+        self.redo_stack = []
+        self.size = 0  # Размер операций в обоих стеках
+        self.seq = 0  # Номер последней записи журнала
+        self.replaying = False  # Во время отмены, повтора и восстановления операции не записываются
+        self._ops = None
+        self._label = None
+        self._depth = 0
+        self._journal = None
+        self._journal_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def action(self, label):
+        # Операции внутри блока, в том числе из вложенных действий, отменяются одним шагом
+        if self._depth == 0:
+            self._ops, self._label = [], label
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                ops, self._ops = self._ops, None
+                if ops:
+                    self.push(self._label, ops)
+
+    def record(self, op):
+        if self.replaying:
+            return
+        if self._ops is not None:
+            self._ops.append(op)
+        else:
+            self.write_journal([op])  # Вне действия (например, квесты при запуске) - только в журнал, без отмены
+
+    def push(self, label, ops):
+        size = self.write_journal(ops)
+        self.size += size - sum(entry[2] for entry in self.redo_stack)
+        self.redo_stack = []
+        self.undo_stack.append((label, ops, size))
+        while self.size > self.budget and len(self.undo_stack) > 1:
+            self.size -= self.undo_stack.popleft()[2]
+
+    def take_undo(self):
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        self.redo_stack.append(entry)
+        return entry
+
+    def take_redo(self):
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        self.undo_stack.append(entry)
+        return entry
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self.size = 0
+
+    def write_journal(self, ops):
+        # Дописывает запись в журнал и возвращает ее размер
+        self.seq += 1
+        line = json.dumps({"seq": self.seq, "ops": ops}, ensure_ascii=False) + "\n"
+        if self.journal_path:
+            with self._journal_lock:
+                if self._journal is None:
+                    self._journal = open(self.journal_path, "a", encoding="utf-8")
+                self._journal.write(line)
+                self._journal.flush()
+        return len(line)
+
+    def pending(self):
+        # Записи журнала [(номер, операции)]; оборванная при сбое последняя строка отбрасывается
+        entries = []
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return entries
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entries.append((entry["seq"], entry["ops"]))
+                except (ValueError, KeyError, TypeError):
+                    break
+        return entries
+
+    def checkpoint(self, seq):
+        # Записи до seq включительно уже в хранилище. Вызывается из потока записи
+        if not self.journal_path:
+            return
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            kept = [(entry_seq, ops) for entry_seq, ops in self.pending() if entry_seq > seq]
+            if not kept:
+                if os.path.exists(self.journal_path):
+                    os.remove(self.journal_path)
+                return
+            tmp_path = self.journal_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry_seq, ops in kept:
+                    f.write(json.dumps({"seq": entry_seq, "ops": ops}, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.journal_path)
+
+    def close(self):
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+# Неизменяемое состояние модели для фоновых потоков: version растет с каждой публикацией,
+# journal_seq - последняя запись журнала, уже отраженная в снимке
+ModelSnapshot = collections.namedtuple("ModelSnapshot", "version tasks habits user_profile journal_seq")
+
+
+# События, которые при пакетных операциях не рассылаются сразу, а входят в сводку batch_completed
+BATCH_COLLECTED_EVENTS = ("profile_changed", "level_up", "quest_assigned", "quest_completed", "quest_expired",
+                          "quests_changed")
+
+
+class TaskEngine:
+    # Предметная логика без привязки к Tk: задачи, привычки, опыт и уровни, квесты, напоминания и хранение.
+    # Интерфейс подписывается на события через subscribe; сообщения пользователю показывает он сам
+    def __init__(self, storage, save_window=0.5, reminder_callback=None, notification_callback=None,
+                 journal_path=None):
+        self.tasks = TaskStore()
+        self.task_index = TaskIndex()  # Поиск по словам и фильтры по срокам
+        self.habits = []
+        self.habits_by_id = {}
+        self.stats = Statistics()
+        self.user_profile = UserProfile()  # Создаем профиль пользователя
+        self.quest_engine = QuestEngine(self.load_quests())
+
+        self.storage = storage
+        self._listeners = collections.defaultdict(list)
+        self._collected = None  # События, собираемые во время пакетной операции
+        # Изменения с последней публикации снимка и уже опубликованные, но еще не записанные: ("task" или "habit", id)
+        self._changed = set()
+        self._removed = set()
+        self._published_changed = set()
+        self._published_removed = set()
+        self._changed_lock = threading.Lock()  # Публикация снимка вместе с изменениями и их прием потоком записи
+        self.snapshot = None  # Последний опубликованный ModelSnapshot
+        self._version = 0
+        self._frozen_habits = {}  # id -> копия привычки для снимков, сбрасывается при изменении привычки
+        self.history = History(journal_path)  # Отмена, повтор и журнал для восстановления после сбоя
+        self.saver = BackgroundSaver(self.write_data, window=save_window)
+        # reminder_callback вызывается из потока планировщика с ключом напоминания, обработка - process_reminder
+        self.reminders = ReminderScheduler(reminder_callback or (lambda key: None))
+        # notification_callback получает из потока очереди заголовок и текст сводки уведомлений
+        self.notifications = NotificationQueue(notification_callback or (lambda title, message: None))
+
+    # --- События ---
+    def subscribe(self, event, callback):
+        self._listeners[event].append(callback)
+
+    def emit(self, event, **data):
+        if self._collected is not None and event in BATCH_COLLECTED_EVENTS:
+            self._collected.append((event, data))
+            return
+        for callback in self._listeners[event]:
+            callback(**data)
+
+    # --- Задачи и привычки ---
+    @timed()
+    def add_task(self, description, due_date):
+        with self.history.action("Добавление задачи"):
+            task = self._insert_task(Task(description, due_date))
+        self.emit("task_added", task=task)
+        self.save()
+        return task
+
+    @timed()
+    def find_tasks(self, text="", first=None, last=None, open_only=False):
+        # id задач в порядке списка: описание подходит под запрос text, срок в first..last
+        # (None - без ограничения), open_only - только невыполненные
+        matches = [self.task_index.search(text) if text.strip() else None]
+        if first or last or open_only:
+            matches.append(self.task_index.due_between(first, last, open_only))
+        matches = [ids for ids in matches if ids is not None]
+        if not matches:
+            return list(self.tasks.ids)
+        matches.sort(key=len)
+        found = matches[0].intersection(*matches[1:])
+        return sorted(found, key=self.tasks.rows.__getitem__)
+
+    @timed()
+    def add_habit(self, description, frequency):
+        with self.history.action("Добавление привычки"):
+            habit = self._insert_habit(Habit(description, frequency))
+        self.emit("habit_added", habit=habit)
+        self.save()
+        return habit
+
+    @timed()
+    def import_items(self, tasks, habits):
+        # Порция импорта: одно обновление модели, одно событие items_imported и один запрос сохранения.
+        # Задачи и привычки с уже существующим id пропускаются; возвращает число пропущенных
+        new_tasks, new_habits = [], []
+        with self.history.action("Импорт"):
+            for task in tasks:
+                if task.id not in self.tasks:
+                    new_tasks.append(self._insert_task(task))
+            for habit in habits:
+                if habit.id not in self.habits_by_id:
+                    new_habits.append(self._insert_habit(habit))
+        if new_tasks or new_habits:
+            self.emit("items_imported", tasks=new_tasks, habits=new_habits)
+            self.save()
+        return len(tasks) + len(habits) - len(new_tasks) - len(new_habits)
+
+    @timed()
+    def toggle_task(self, task_id):
+        # Переключает отметку выполнения; KeyError, если задачи нет
+        task = self.tasks[task_id]
+        with self.history.action("Отметка задачи"):
+            self._set_task_completed(task, not task.completed)
+            self.emit("task_changed", task=task)
+            self.save()
+
+            if task.completed:
+                self.award_experience(10)  # Награждаем опытом за выполнение задачи
+                self.notify_quests("task_completed", tasks=[task])
+        return task
+
+    @timed()
+    def toggle_habit(self, habit_id, day=None):
+        # Переключает отметку привычки за день (по умолчанию сегодня); KeyError, если привычки нет
+        habit = self.habits_by_id[habit_id]
+        day = (day or datetime.date.today()).strftime("%Y-%m-%d")
+        marked = day not in habit.completed_dates
+        with self.history.action("Отметка привычки"):
+            self._set_habit_marked(habit, day, marked)
+            self.emit("habit_changed", habit=habit)
+            self.save()
+
+            self.award_experience(5)  # Награждаем опытом за выполнение привычки
+            if marked:
+                self.notify_quests("habit_marked", habits=[habit])
+        return habit
+
+    @timed()
+    def complete_tasks(self, task_ids, completed=True):
+        # Пакетная отметка задач выполненными (или невыполненными при completed=False): опыт, уровни и квесты
+        # считаются один раз на весь пакет, интерфейс получает одно событие tasks_changed и одну сводку
+        # batch_completed, запрос сохранения тоже один. Возвращает изменившиеся задачи
+        changed = []
+        with self.history.action("Отметка задач"):
+            for task_id in task_ids:
+                task = self.tasks[task_id]
+                if bool(task.completed) != completed:
+                    self._set_task_completed(task, completed)
+                    changed.append(task)
+            if completed:
+                self._finish_batch("tasks_changed", changed, 10 * len(changed), "task_completed", tasks=changed)
+            else:
+                self._finish_batch("tasks_changed", changed, 0)
+        return changed
+
+    @timed()
+    def mark_habits(self, habit_ids, marked=True, day=None):
+        # Пакетная отметка привычек за день, как complete_tasks. Опыт начисляется только за новые отметки
+        day = (day or datetime.date.today()).strftime("%Y-%m-%d")
+        changed = []
+        with self.history.action("Отметка привычек"):
+            for habit_id in habit_ids:
+                habit = self.habits_by_id[habit_id]
+                if (day in habit.completed_dates) != marked:
+                    self._set_habit_marked(habit, day, marked)
+                    changed.append(habit)
+            if marked:
+                self._finish_batch("habits_changed", changed, 5 * len(changed), "habit_marked", habits=changed)
+            else:
+                self._finish_batch("habits_changed", changed, 0)
+        return changed
+
+    def _finish_batch(self, event, items, experience, quest_event=None, **quest_items):
+        if not items:
+            return
+        # Повышения уровня и квесты внутри пакета не показываются по одному, а попадают в сводку
+        with self.collect_events() as collected:
+            if experience:
+                self.award_experience(experience)
+            if quest_event:
+                self.notify_quests(quest_event, **quest_items)
+        self.emit(event, items=items)
+        self.emit("batch_completed", count=len(items), experience=experience,
+                  levels=[data["level"] for name, data in collected if name == "level_up"],
+                  quests_completed=[data["quest"] for name, data in collected if name == "quest_completed"],
+                  quests_expired=[data["quest"] for name, data in collected if name == "quest_expired"],
+                  quests_assigned=[quest for name, data in collected if name == "quest_assigned"
+                                   for quest in data["quests"]])
+        self.save()
+
+    @contextlib.contextmanager
+    def collect_events(self):
+        # События из BATCH_COLLECTED_EVENTS внутри блока не рассылаются, а собираются в список (событие, данные)
+        collected = self._collected = []
+        try:
+            yield collected
+        finally:
+            self._collected = None
+
+    # Все изменения задач, привычек и профиля проходят через методы ниже и записываются в историю
+    def _insert_task(self, task):
+        task = self.tasks.append(task)
+        self.task_index.add(task)
+        self.stats.task_added(task)
+        self._changed.add(("task", task.id))
+        self._removed.discard(("task", task.id))
+        self.schedule_task_reminder(task)
+        self.history.record(("task", task.id, None, task.to_dict()))
+        return task
+
+    def _remove_task(self, task_id):
+        task = self.tasks[task_id]
+        self.history.record(("task", task_id, task.to_dict(), None))
+        self.task_index.remove(task)
+        self.stats.task_removed(task)
+        self.reminders.cancel(("task", task_id))
+        self._changed.discard(("task", task_id))
+        self._removed.add(("task", task_id))
+        self.tasks.remove(task_id)
+
+    def _insert_habit(self, habit):
+        self.habits.append(habit)
+        self.habits_by_id[habit.id] = habit
+        for day in habit.completed_dates.days():
+            self.stats.habit_marked(day, 1)
+        self._changed.add(("habit", habit.id))
+        self._removed.discard(("habit", habit.id))
+        self.schedule_habit_reminder(habit)
+        self.history.record(("habit", habit.id, None, habit.to_dict()))
+        return habit
+
+    def _remove_habit(self, habit_id):
+        habit = self.habits_by_id.pop(habit_id)
+        self.history.record(("habit", habit_id, habit.to_dict(), None))
+        self.habits.remove(habit)
+        for day in habit.completed_dates.days():
+            self.stats.habit_marked(day, -1)
+        self.reminders.cancel(("habit", habit_id))
+        self._frozen_habits.pop(habit_id, None)
+        self._changed.discard(("habit", habit_id))
+        self._removed.add(("habit", habit_id))
+
+    def _set_task_completed(self, task, completed, completed_on=None):
+        before = [bool(task.completed), task.completed_on.strftime("%Y-%m-%d") if task.completed_on else None]
+        task.completed = completed
+        if completed:
+            task.completed_on = completed_on or datetime.date.today()
+            self.stats.task_completed(task)
+        else:
+            completed_on, task.completed_on = task.completed_on, None
+            self.stats.task_reopened(task, completed_on)
+        self.task_index.completion_changed(task)
+        self.mark_changed(task)
+        self.schedule_task_reminder(task)
+        self.history.record(("task_done", task.id, before,
+                             [completed, task.completed_on.strftime("%Y-%m-%d") if completed else None]))
+
+    def _set_habit_marked(self, habit, day, marked):
+        self.history.record(("habit_mark", [habit.id, day], not marked, marked))
+        if marked:
+            habit.completed_dates[day] = True
+            self.stats.habit_marked(day, 1)
+        else:
+            del habit.completed_dates[day]
+            self.stats.habit_marked(day, -1)
+        self.mark_changed(habit)
+        self.schedule_habit_reminder(habit)
+
+    # --- Профиль, опыт и квесты ---
+    def update_profile(self, name, birth_year):
+        with self.history.action("Изменение профиля"):
+            self._set_profile("name", name if name else "Новый пользователь")
+            self._set_profile("birth_year", birth_year)
+        self.save()
+
+    def set_avatar(self, path):
+        with self.history.action("Смена аватарки"):
+            self._set_profile("avatar_path", path)
+        self.save()
+
+    def _set_profile(self, field, value):
+        old = getattr(self.user_profile, field)
+        if old != value:
+            setattr(self.user_profile, field, value)
+            self.history.record(("profile", field, old, value))
+
+    @timed()
+    def award_experience(self, amount):
+        level, experience = self.user_profile.level, self.user_profile.experience
+        self.user_profile.experience += amount
+        while self.check_level_up():  # Крупная награда может дать несколько уровней сразу
+            pass
+        if self.user_profile.level != level:
+            self.history.record(("profile", "level", level, self.user_profile.level))
+        self.history.record(("profile", "experience", experience, self.user_profile.experience))
+        self.emit("profile_changed")
+        self.save()
+
+    def check_level_up(self):
+        level_up_threshold = self.user_profile.level * 100
+        if self.user_profile.experience >= level_up_threshold:
+            self.user_profile.level += 1
+            self.user_profile.experience -= level_up_threshold
+            self.emit("level_up", level=self.user_profile.level)
+            return True
+        return False
+
+    def assign_quests(self, exclude=()):
+        # Добирает активные квесты до MAX_ACTIVE_QUESTS случайными из неактивных; возвращает новые.
+        # Квесты из exclude (только что выполненные) берутся, только если других не осталось
+        today = datetime.date.today()
+        self.expire_quests(today)
+        available = self.quest_engine.available()
+        available = [quest_id for quest_id in available if quest_id not in exclude] or available
+        count = min(MAX_ACTIVE_QUESTS - len(self.quest_engine.active), len(available))
+        if count <= 0:
+            return []
+        assigned = [self.quest_engine.activate(quest_id, today) for quest_id in random.sample(available, count)]
+        self.quests_changed()
+        self.emit("quest_assigned", quests=assigned)
+        return assigned
+
+    def expire_quests(self, today):
+        expired = self.quest_engine.expire(today)
+        for quest in expired:
+            self.emit("quest_expired", quest=quest)
+        if expired:
+            self.quests_changed()
+            # Освободившиеся места сразу занимают новые квесты (повторный вызов expire_quests уже ничего не снимет)
+            self.assign_quests(exclude={quest["id"] for quest in expired})
+        return expired
+
+    @timed()
+    def notify_quests(self, event, tasks=(), habits=()):
+        # Прогресс квестов по событию: task_completed для задач tasks или habit_marked для привычек habits.
+        # Обрабатываются только квесты, подписанные на это событие
+        today = datetime.date.today()
+        self.expire_quests(today)
+        changed = False
+        completed = []
+        for task in tasks:
+            task_changed, task_completed = self.quest_engine.notify(event, today, task=task)
+            changed |= task_changed
+            completed.extend(task_completed)
+        for habit in habits:
+            habit_changed, habit_completed = self.quest_engine.notify(event, today, habit=habit)
+            changed |= habit_changed
+            completed.extend(habit_completed)
+        for quest in completed:
+            self.complete_quest(quest)
+        if changed or completed:
+            self.quests_changed()
+        if completed:
+            self.assign_quests(exclude={quest["id"] for quest in completed})
+
+    def complete_quest(self, quest):
+        self.emit("quest_completed", quest=quest)
+        self._set_profile("quests_completed", self.user_profile.quests_completed + 1)
+        self.award_experience(quest["reward"])
+
+    def quests_changed(self):
+        # Состояние квестов хранится в профиле и сохраняется вместе с ним
+        before, self.user_profile.active_quests = self.user_profile.active_quests, self.quest_engine.state()
+        self.history.record(("quests", None, before, self.user_profile.active_quests))
+        self.emit("quests_changed")
+        self.save()
+
+    def load_quests(self, path=QUESTS_FILE):
+        # Определения квестов из файла, без файла - встроенные. Некорректные определения пропускаются
+        definitions = DEFAULT_QUESTS
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    definitions = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Ошибка при загрузке квестов из {path}: {e}")
+        quests = []
+        for definition in definitions if isinstance(definitions, list) else ():
+            try:
+                quests.append(validate_quest(definition))
+            except ValueError as e:
+                print(f"Квест пропущен: {e}")
+        return quests
+
+    # --- Отмена и повтор ---
+    @timed()
+    def undo(self):
+        # Отменяет последнее действие; возвращает его название или None, если отменять нечего
+        entry = self.history.take_undo()
+        if entry is None:
+            return None
+        label, ops, _ = entry
+        self._replay(label, [(kind, target, after, before) for kind, target, before, after in reversed(ops)])
+        return label
+
+    @timed()
+    def redo(self):
+        entry = self.history.take_redo()
+        if entry is None:
+            return None
+        label, ops, _ = entry
+        self._replay(label, ops)
+        return label
+
+    def _replay(self, label, ops):
+        structure_changed, profile_fields = self._apply_ops(ops)
+        self.history.write_journal(ops)  # Отмена - такое же изменение данных, его тоже нужно восстановить после сбоя
+        self.emit("history_applied", label=label, structure_changed=structure_changed, profile_fields=profile_fields)
+        self.save()
+
+    def _apply_ops(self, ops):
+        # Применяет значения "стало". Операции, результат которых уже есть в модели, пропускаются, поэтому
+        # запись журнала, успевшую попасть в хранилище, можно применить повторно.
+        # Возвращает (менялся ли состав задач и привычек, измененные поля профиля)
+        structure_changed = False
+        profile_fields = set()
+        self.history.replaying = True
+        try:
+            for kind, target, _, value in ops:
+                if kind == "task":
+                    structure_changed = True
+                    if value is None and target in self.tasks:
+                        self._remove_task(target)
+                    elif value is not None and target not in self.tasks:
+                        self._insert_task(Task.from_dict(value))
+                elif kind == "task_done":
+                    task = self.tasks.get(target)
+                    if task is not None and bool(task.completed) != value[0]:
+                        self._set_task_completed(task, value[0], parse_date(value[1]) if value[1] else None)
+                elif kind == "habit":
+                    structure_changed = True
+                    if value is None and target in self.habits_by_id:
+                        self._remove_habit(target)
+                    elif value is not None and target not in self.habits_by_id:
+                        self._insert_habit(Habit.from_dict(value))
+                elif kind == "habit_mark":
+                    habit = self.habits_by_id.get(target[0])
+                    if habit is not None and (target[1] in habit.completed_dates) != value:
+                        self._set_habit_marked(habit, target[1], value)
+                elif kind == "profile":
+                    setattr(self.user_profile, target, value)
+                    profile_fields.add(target)
+                elif kind == "quests":
+                    self.quest_engine.load_state(value or [])
+                    self.user_profile.active_quests = value
+                    profile_fields.add("active_quests")
+        finally:
+            self.history.replaying = False
+        return structure_changed, profile_fields
+
+    # --- Календарь ---
+    @timed()
+    def calendar_days(self, first, last):
+        # Сводка по дням first..last: задачи - из индекса сроков и счетчиков статистики, повторения привычек
+        # разворачиваются только в пределах окна. Цена зависит от размера окна, а не от объема данных
+        occurrences = collections.defaultdict(list)
+        for habit in self.habits:
+            for day, done in habit_occurrences(habit, first, last):
+                occurrences[day].append((habit, done))
+        days = []
+        day = first
+        while day <= last:
+            days.append(CalendarDay(day, len(self.task_index.due.by_day.get(day.toordinal(), ())),
+                                    self.stats.open_by_due[day], self.stats.task_completions_by_day[day],
+                                    self.stats.habit_completions_by_day[day], occurrences[day]))
+            day += datetime.timedelta(days=1)
+        return days
+
+    def tasks_due_on(self, day, limit=None):
+        # Задачи со сроком day в порядке списка, не больше limit
+        ids = sorted(self.task_index.due.by_day.get(day.toordinal(), ()), key=self.tasks.rows.__getitem__)
+        return [self.tasks[task_id] for task_id in ids[:limit]]
+
+    # --- Напоминания ---
+    def task_reminder_time(self, task, day):
+        return datetime.datetime.combine(max(task.due_date, day), TASK_REMINDER_TIME)
+
+    def habit_reminder_time(self, habit, day):
+        # Конец ближайшего периода, в котором привычка еще не отмечена
+        end = habit_period_end(habit.frequency, day)
+        if habit_done_in_period(habit, day):
+            end = habit_period_end(habit.frequency, end + datetime.timedelta(days=1))
+        return datetime.datetime.combine(end, HABIT_REMINDER_TIME)
 
-class Task:
-    def __init__(self, description, due_date, completed=False):
-        self.description = description
-        self.due_date = due_date
-        self.completed = completed
+    def schedule_task_reminder(self, task):
+        if task.completed:
+            self.reminders.cancel(("task", task.id))
+        else:
+            self.reminders.schedule(("task", task.id), self.task_reminder_time(task, datetime.date.today()))
 
-    def __str__(self):
-        return f"{self.description} (Срок: {self.due_date.strftime('%Y-%m-%d')})"
+    def schedule_habit_reminder(self, habit):
+        self.reminders.schedule(("habit", habit.id), self.habit_reminder_time(habit, datetime.date.today()))
 
-    def to_dict(self):
-        return {
-            "description": self.description,
-            "due_date": self.due_date.strftime("%Y-%m-%d"),
-            "completed": self.completed
-        }
+    @timed()
+    def reschedule_reminders(self):
+        today = datetime.date.today()
+        items = [(("task", task.id), self.task_reminder_time(task, today)) for task in self.tasks if not task.completed]
+        items.extend((("habit", habit.id), self.habit_reminder_time(habit, today)) for habit in self.habits)
+        self.reminders.reset(items)
 
-    @classmethod
-    def from_dict(cls, data):
-        return cls(data["description"], datetime.datetime.strptime(data["due_date"], "%Y-%m-%d").date(),
-                   data["completed"])
+    @timed()
+    def process_reminder(self, key):
+        # Обработка сработавшего напоминания: уведомление уходит в очередь, напоминание переносится на следующий раз.
+        # Возвращает уведомление, если оно принято очередью (не повтор за сегодня)
+        kind, item_id = key
+        today = datetime.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        notification = None
+        if kind == "task":
+            item = self.tasks.get(item_id)
+            if item is None or item.completed:
+                return None
+            if item.due_date < today:
+                notification = Notification(
+                    "overdue", item_id, today, item.description, "Задача просрочена!",
+                    f"Задача '{item.description}' просрочена (срок: {item.due_date.strftime('%Y-%m-%d')})")
+            else:
+                notification = Notification("due", item_id, today, item.description, "Задача!",
+                                            f"Задача '{item.description}' должна быть выполнена сегодня!")
+            # Пока задача не выполнена, напоминаем раз в день
+            self.reminders.schedule(key, datetime.datetime.combine(tomorrow, TASK_REMINDER_TIME))
+        else:
+            item = self.habits_by_id.get(item_id)
+            if item is None:
+                return None
+            if not habit_done_in_period(item, today):
+                notification = Notification("habit", item_id, today, item.description, "Привычка!",
+                                            f"Не забудьте отметить привычку '{item.description}'")
+            next_period = habit_period_end(item.frequency, today) + datetime.timedelta(days=1)
+            self.reminders.schedule(key, self.habit_reminder_time(item, next_period))
+        if notification is not None and self.notifications.push(notification):
+            return notification
+        return None
 
+    # --- Хранение ---
+    def mark_changed(self, item):
+        # Модель меняет только поток интерфейса (или поток, владеющий движком без интерфейса)
+        if isinstance(item, Habit):
+            self._frozen_habits.pop(item.id, None)
+            self._changed.add(("habit", item.id))
+        else:
+            self._changed.add(("task", item.id))
 
-class Habit:
-    def __init__(self, description, frequency, goal="", completed_dates=None):
-        self.description = description
-        self.frequency = frequency  # "daily", "weekly", "monthly"
-        self.goal = goal
-        self.completed_dates = completed_dates or {}
+    def save(self):
+        # Запись выполнит фоновый поток, несколько запросов подряд дадут одну запись
+        self.publish()
+        self.saver.request_save()
 
-    def __str__(self):
-        return f"{self.description} ({self.frequency})"
+    @timed()
+    def flush(self):
+        self.publish()
+        self.saver.flush()
 
-    def to_dict(self):
-        return {
-            "description": self.description,
-            "frequency": self.frequency,
-            "goal": self.goal,
-            "completed_dates": self.completed_dates
-        }
+    def _frozen_habit(self, habit):
+        frozen = self._frozen_habits.get(habit.id)
+        if frozen is None:
+            frozen = self._frozen_habits[habit.id] = Habit(habit.description, habit.frequency, habit.goal,
+                                                           habit_id=habit.id)
+            frozen.completed_dates = habit.completed_dates.copy()
+        return frozen
 
-    @classmethod
-    def from_dict(cls, data):
-        return cls(data["description"], data["frequency"], data["goal"], data["completed_dates"])
+    def publish(self):
+        # Публикует новый снимок модели (RCU): задачи не копируются (TaskStore.freeze), привычки - только
+        # изменившиеся. Вместе со снимком потоку записи передаются накопленные изменения, поэтому он никогда
+        # не увидит изменение раньше данных, к которым оно относится
+        snapshot = ModelSnapshot(self._version + 1, self.tasks.freeze(),
+                                 tuple(self._frozen_habit(habit) for habit in self.habits),
+                                 self.user_profile.copy(), self.history.seq)
+        with self._changed_lock:
+            self._version, self.snapshot = snapshot.version, snapshot
+            if self._removed:
+                self._published_changed -= self._removed
+                self._published_removed |= self._removed
+                self._removed = set()
+            if self._changed:
+                self._published_removed -= self._changed
+                self._published_changed |= self._changed
+                self._changed = set()
+        return snapshot
 
+    def take_snapshot(self):
+        # Последний опубликованный снимок для чтения из любого потока без блокировок модели. None - снимок
+        # устарел, а новый еще не опубликован (поток интерфейса посреди действия), нужно повторить позже
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.tasks.take():
+            return None
+        return snapshot
 
-class UserProfile:
-    def __init__(self, name="Новый пользователь", level=1, experience=0, quests_completed=0, avatar_path=None, birth_year=None):
-        self.name = name
-        self.level = level
-        self.experience = experience
-        self.quests_completed = quests_completed
-        self.avatar_path = avatar_path  # Путь к файлу аватарки
-        self.birth_year = birth_year
+    @timed()
+    def write_data(self):
+        with self._changed_lock:
+            snapshot = self.take_snapshot()
+            if snapshot is None:
+                self.saver.request_save()
+                return
+            changed, self._published_changed = self._published_changed, set()
+            removed, self._published_removed = self._published_removed, set()
+        habits = {habit.id: habit for habit in snapshot.habits}
+        items = []
+        for kind, item_id in changed:
+            item = habits.get(item_id) if kind == "habit" else snapshot.tasks.get(item_id)
+            if item is not None:
+                items.append(item)
+        try:
+            self.storage.save(snapshot.tasks, snapshot.habits, snapshot.user_profile, items, removed)
+        except Exception as e:
+            with self._changed_lock:
+                self._published_changed |= changed
+                self._published_removed |= removed
+            print(f"Ошибка при сохранении данных: {e}")
+            self.emit("save_failed", error=e)  # Из потока записи
+            return
+        try:
+            self.history.checkpoint(snapshot.journal_seq)
+        except OSError as e:
+            print(f"Ошибка при обрезке журнала: {e}")
 
-    def to_dict(self):
-        return {
-            "name": self.name,
-            "level": self.level,
-            "experience": self.experience,
-            "quests_completed": self.quests_completed,
-            "avatar_path": self.avatar_path,
-            "birth_year": self.birth_year
-        }
+    def begin_load(self, batch_size=LOAD_BATCH_SIZE):
+        # Очищает модель и возвращает генератор порций; каждую порцию передают в apply_loaded, в конце - finish_load
+        self.flush()  # Несохраненные изменения не должны потеряться при перечитывании
+        self.reset()
+        return self.storage.load_batches(batch_size)
 
-    @classmethod
-    def from_dict(cls, data):
-        return cls(
-            name=data.get("name", "Новый пользователь"),
-            level=data.get("level", 1),
-            experience=data.get("experience", 0),
-            quests_completed=data.get("quests_completed", 0),
-            avatar_path=data.get("avatar_path"),
-            birth_year=data.get("birth_year")
-        )
+    def apply_loaded(self, kind, items):
+        if kind == "tasks":
+            self.tasks.extend(items)
+        elif kind == "habits":
+            self.habits.extend(items)
+            self.habits_by_id.update((habit.id, habit) for habit in items)
+        else:
+            self.user_profile = items[0]
+
+    @timed()
+    def finish_load(self):
+        self._changed = set()
+        self._removed = set()
+        self._frozen_habits = {}
+        self.publish()
+        self.reschedule_reminders()
+        self.task_index.reset(self.tasks)
+        self.stats.reset(self.tasks, self.habits)
+        self.quest_engine.load_state(self.user_profile.active_quests or [])
+        self.recover_journal()
+        self.emit("loaded")
+
+    def recover_journal(self):
+        # Действия из журнала, не дошедшие до хранилища из-за сбоя, применяются к загруженным данным
+        try:
+            pending = self.history.pending()
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Ошибка при чтении журнала: {e}")
+            return
+        if not pending:
+            return
+        for _, ops in pending:
+            self._apply_ops(ops)
+        self.history.seq = max(self.history.seq, pending[-1][0])
+        print(f"Восстановлено действий из журнала: {len(pending)}")
+        self.save()
+
+    def load(self):
+        # Синхронная загрузка целиком, без интерфейса
+        for kind, items, _ in self.begin_load():
+            self.apply_loaded(kind, items)
+        self.finish_load()
+
+    def reset(self, keep_profile=True):
+        self.history.clear()
+        self.tasks = TaskStore()
+        self.task_index = TaskIndex()
+        self.habits = []
+        self.habits_by_id = {}
+        if not keep_profile:
+            self.user_profile = UserProfile()
+            self.quest_engine.load_state([])
+
+    def close(self):
+        self.notifications.stop()
+        self.save()  # Последняя запись доводит контрольную точку журнала до конца
+        self.saver.stop()
+        self.storage.close()
+        self.history.close()
 
 
 class TaskManager:
-    def __init__(self, master):
+    # Интерфейс на Tk поверх TaskEngine: читает поля ввода, показывает сообщения и обновляет виджеты по событиям
+    def __init__(self, master, storage=None, save_window=0.5):
         self.master = master
         master.title("Менеджер задач и привычек")
 
-        self.tasks = []
-        self.habits = []
-        self.user_profile = UserProfile()  # Создаем профиль пользователя
-        self.quests = self.load_quests()
-        self.active_quest = None
+        self.data_file = "data.json"  # Прежний формат, переносится в базу при первом запуске
+        self.db_file = "data.db"
 
-        self.data_file = "data.json"
+        # Замеры и профилирование включаются переменными окружения, см. Metrics
+        metrics_path = os.environ.get("TASKMANAGER_METRICS")
+        self.debug = bool(os.environ.get("TASKMANAGER_DEBUG"))
+        if metrics_path:
+            METRICS.enable(METRICS_FILE if metrics_path == "1" else metrics_path)
+        if self.debug:
+            METRICS.enable()
+        profile_actions = os.environ.get("TASKMANAGER_PROFILE_ACTIONS")
+        if profile_actions:
+            METRICS.profile_next(int(profile_actions), f"profile-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        storage = storage or SQLiteStorage(self.db_file, legacy_json=self.data_file)
+        self._fired_reminders = []  # Ключи сработавших напоминаний, ждущие обработки в главном потоке
+        self._fired_lock = threading.Lock()
+        self.engine = TaskEngine(
+            storage, save_window=save_window, reminder_callback=self.queue_reminder,
+            notification_callback=lambda title, message: self.call_in_ui(self.show_notification, title, message),
+            journal_path=JOURNAL_FILE)
+        self.engine.subscribe("task_added", self.on_task_added)
+        self.engine.subscribe("task_changed", self.on_task_changed)
+        self.engine.subscribe("habit_added", self.on_habit_added)
+        self.engine.subscribe("habit_changed", self.on_habit_changed)
+        self.engine.subscribe("items_imported", self.on_items_imported)
+        self.engine.subscribe("tasks_changed", self.on_tasks_changed)
+        self.engine.subscribe("habits_changed", self.on_habits_changed)
+        self.engine.subscribe("batch_completed", self.on_batch_completed)
+        self.engine.subscribe("profile_changed", self.update_user_profile)
+        self.engine.subscribe("level_up", self.on_level_up)
+        self.engine.subscribe("quest_assigned", self.on_quest_assigned)
+        self.engine.subscribe("quest_completed", self.on_quest_completed)
+        self.engine.subscribe("quest_expired", self.on_quest_expired)
+        self.engine.subscribe("quests_changed", self.refresh_profile_labels)
+        self.engine.subscribe("history_applied", self.on_history_applied)
+        self.engine.subscribe("save_failed", self.on_save_failed)
+        self.avatar_loader = AvatarLoader()
+
+        # Вызовы из фоновых потоков выполняются в главном цикле Tk
+        self._ui_calls = queue.Queue()
+        self.process_ui_calls()
+        master.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # --- Styling ---
         self.style = ttk.Style()
@@ -121,38 +3117,108 @@ class TaskManager:
         self.notebook.add(self.task_frame, text="Задачи")
         self.create_task_tab(self.task_frame)
 
+        # Остальные вкладки строятся при первом открытии
+        self.tab_builders = {}
+
         # Habit Frame
         self.habit_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.habit_frame, text="Привычки")
-        self.create_habit_tab(self.habit_frame)
+        self.tab_builders[str(self.habit_frame)] = self.create_habit_tab
+
+        # Calendar Frame
+        self.calendar_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.calendar_frame, text="Календарь")
+        self.tab_builders[str(self.calendar_frame)] = self.create_calendar_tab
 
         # User Frame
         self.user_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.user_frame, text="Профиль")
-        self.create_user_tab(self.user_frame)
+        self.tab_builders[str(self.user_frame)] = self.create_user_tab
+
+        # Statistics Frame
+        self.stats_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.stats_frame, text="Статистика")
+        self.tab_builders[str(self.stats_frame)] = self.create_stats_tab
+
+        # Debug Frame - только с TASKMANAGER_DEBUG
+        self.debug_frame = None
+        self._debug_job = None
+        if self.debug:
+            self.debug_frame = ttk.Frame(self.notebook)
+            self.notebook.add(self.debug_frame, text="Отладка")
+            self.tab_builders[str(self.debug_frame)] = self.create_debug_tab
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
 
         # --- Bottom Buttons Frame ---
         self.bottom_frame = ttk.Frame(master)
         self.bottom_frame.grid(row=1, column=0, padx=5, pady=5, sticky="ew")
 
-        self.save_button = ttk.Button(self.bottom_frame, text="Сохранить", command=self.save_data)
+        self.save_button = ttk.Button(self.bottom_frame, text="Сохранить", command=self.engine.flush)
         self.save_button.grid(row=0, column=0, padx=5, pady=5, sticky="w")
 
         self.load_button = ttk.Button(self.bottom_frame, text="Загрузить", command=self.load_data)
         self.load_button.grid(row=0, column=1, padx=5, pady=5, sticky="w")
 
+        self.import_button = ttk.Button(self.bottom_frame, text="Импорт", command=self.import_data)
+        self.import_button.grid(row=0, column=2, padx=5, pady=5, sticky="w")
+
+        self.export_button = ttk.Button(self.bottom_frame, text="Экспорт", command=self.export_data)
+        self.export_button.grid(row=0, column=3, padx=5, pady=5, sticky="w")
+
+        self.undo_button = ttk.Button(self.bottom_frame, text="Отменить", command=self.undo)
+        self.undo_button.grid(row=0, column=4, padx=5, pady=5, sticky="w")
+
+        self.redo_button = ttk.Button(self.bottom_frame, text="Повторить", command=self.redo)
+        self.redo_button.grid(row=0, column=5, padx=5, pady=5, sticky="w")
+        master.bind("<Control-z>", self.undo)
+        master.bind("<Control-y>", self.redo)
+
+        self.load_progress = ttk.Progressbar(self.bottom_frame, mode="determinate", maximum=100)
+        self.load_progress.grid(row=0, column=6, padx=5, pady=5, sticky="ew")
+        self.load_progress.grid_remove()  # Видна только во время загрузки, импорта и экспорта
+
         # --- Configure Weights ---
         master.columnconfigure(0, weight=1)
         self.bottom_frame.columnconfigure(0, weight=1)
         self.bottom_frame.columnconfigure(1, weight=1)
 
-        # Load data and start reminders
-        self.load_data()
-        self.update_task_list()
-        self.update_habit_list()
+        # Load data and start reminders - после того, как окно отрисовано
+        self._loader = None
+        self._on_loaded = None
+        self._transfer = None  # Идущий импорт или экспорт
+        self._started = False
+        master.bind("<Map>", self.on_map, add="+")
+        if METRICS.enabled:
+            self.monitor_event_loop()
+
+    def on_map(self, event):
+        if event.widget is not self.master or self._started:
+            return
+        self._started = True
+        # Отрисовка окна тоже идет через idle-обработчики, поэтому ждем их и еще один оборот цикла
+        self.master.after_idle(self.master.after, 0, self.on_first_frame)
+
+    def on_first_frame(self):
+        if STARTUP_BENCH:
+            print(f"first_frame {time.time():.6f}", flush=True)
+        self.load_data(on_done=self.on_startup_loaded)
+
+    def on_startup_loaded(self):
+        if STARTUP_BENCH:
+            print(f"data_loaded {time.time():.6f}", flush=True)
+            self.on_close()
+            return
+        self.load_avatar()
         self.update_user_profile()
-        self.assign_quest()  # Назначаем первый квест
-        self.start_reminder_thread()
+        self.engine.assign_quests()  # Назначаем первый квест
+
+    def is_tab_built(self, frame):
+        return str(frame) not in self.tab_builders
+
+    def build_tab(self, frame):
+        builder = self.tab_builders.pop(str(frame), None)
+        if builder:
+            builder(frame)
 
     def create_task_tab(self, frame):
         self.task_description_label = ttk.Label(frame, text="Описание:")
@@ -168,12 +3234,46 @@ class TaskManager:
         self.add_task_button = ttk.Button(frame, text="Добавить задачу", command=self.add_task)
         self.add_task_button.grid(row=2, column=0, columnspan=2, padx=5, pady=5)
 
-        self.task_listbox = tk.Listbox(frame, width=50, height=10)
-        self.task_listbox.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
-        self.task_listbox.bind("<Double-Button-1>", self.complete_task)
+        # Поиск и фильтр по сроку
+        self.task_filter = None  # (запрос, первый день, последний день, только невыполненные) или None
+        self._task_filter_job = None
+        self.task_filter_frame = ttk.Frame(frame)
+        self.task_filter_frame.grid(row=3, column=0, columnspan=2, padx=5, pady=2, sticky="ew")
+
+        self.task_search_label = ttk.Label(self.task_filter_frame, text="Поиск:")
+        self.task_search_label.grid(row=0, column=0, sticky="w")
+        self.task_search_entry = ttk.Entry(self.task_filter_frame, width=20)
+        self.task_search_entry.grid(row=0, column=1, padx=5, sticky="ew")
+        self.task_search_entry.bind("<KeyRelease>", self.schedule_task_filter)
+
+        self.task_filter_combobox = ttk.Combobox(
+            self.task_filter_frame, state="readonly", width=15,
+            values=["Все", "Невыполненные", "Просроченные", "Сегодня", "На этой неделе", "За период"])
+        self.task_filter_combobox.grid(row=0, column=2, padx=5)
+        self.task_filter_combobox.set("Все")
+        self.task_filter_combobox.bind("<<ComboboxSelected>>", self.schedule_task_filter)
+
+        self.task_from_label = ttk.Label(self.task_filter_frame, text="с")
+        self.task_from_label.grid(row=0, column=3)
+        self.task_from_entry = ttk.Entry(self.task_filter_frame, width=11)
+        self.task_from_entry.grid(row=0, column=4, padx=2)
+        self.task_from_entry.bind("<KeyRelease>", self.schedule_task_filter)
+        self.task_to_label = ttk.Label(self.task_filter_frame, text="по")
+        self.task_to_label.grid(row=0, column=5)
+        self.task_to_entry = ttk.Entry(self.task_filter_frame, width=11)
+        self.task_to_entry.grid(row=0, column=6, padx=2)
+        self.task_to_entry.bind("<KeyRelease>", self.schedule_task_filter)
+        self.task_filter_frame.columnconfigure(1, weight=1)
+
+        self.task_list = VirtualListView(frame, self.format_task_rows, height=10, selectmode="extended")
+        self.task_list.grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.task_list.bind_activate(self.complete_task)
+
+        self.complete_tasks_button = ttk.Button(frame, text="Отметить выбранные", command=self.complete_task)
+        self.complete_tasks_button.grid(row=5, column=0, columnspan=2, padx=5, pady=5)
 
         frame.columnconfigure(1, weight=1)  # Entry expands
-        frame.rowconfigure(3, weight=1)  # Listbox expands
+        frame.rowconfigure(4, weight=1)  # List expands
 
     def create_habit_tab(self, frame):
         self.habit_description_label = ttk.Label(frame, text="Описание:")
@@ -190,12 +3290,17 @@ class TaskManager:
         self.add_habit_button = ttk.Button(frame, text="Добавить привычку", command=self.add_habit)
         self.add_habit_button.grid(row=2, column=0, columnspan=2, padx=5, pady=5)
 
-        self.habit_listbox = tk.Listbox(frame, width=50, height=10)
-        self.habit_listbox.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
-        self.habit_listbox.bind("<Double-Button-1>", self.complete_habit)
+        self.habit_list = VirtualListView(frame, self.format_habit_rows, height=10, selectmode="extended")
+        self.habit_list.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.habit_list.bind_activate(self.complete_habit)
+
+        self.complete_habits_button = ttk.Button(frame, text="Отметить выбранные", command=self.complete_habit)
+        self.complete_habits_button.grid(row=4, column=0, columnspan=2, padx=5, pady=5)
 
         frame.columnconfigure(1, weight=1)  # Entry expands
-        frame.rowconfigure(3, weight=1)  # Listbox expands
+        frame.rowconfigure(3, weight=1)  # List expands
+
+        self.update_habit_list()
 
     def create_user_tab(self, frame):
         # Avatar
@@ -226,58 +3331,379 @@ class TaskManager:
         # Level, Experience, Quests Completed
         self.level_label = ttk.Label(frame, text="Уровень:")
         self.level_label.grid(row=5, column=0, padx=5, pady=2, sticky="w")
-        self.level_value_label = ttk.Label(frame, text=str(self.user_profile.level))
+        self.level_value_label = ttk.Label(frame, text=str(self.engine.user_profile.level))
         self.level_value_label.grid(row=5, column=1, padx=5, pady=2, sticky="w")
 
         self.experience_label = ttk.Label(frame, text="Опыт:")
         self.experience_label.grid(row=6, column=0, padx=5, pady=2, sticky="w")
-        self.experience_value_label = ttk.Label(frame, text=str(self.user_profile.experience))
+        self.experience_value_label = ttk.Label(frame, text=str(self.engine.user_profile.experience))
         self.experience_value_label.grid(row=6, column=1, padx=5, pady=2, sticky="w")
 
         self.quests_completed_label = ttk.Label(frame, text="Квестов выполнено:")
         self.quests_completed_label.grid(row=7, column=0, padx=5, pady=2, sticky="w")
-        self.quests_completed_value_label = ttk.Label(frame, text=str(self.user_profile.quests_completed))
+        self.quests_completed_value_label = ttk.Label(frame, text=str(self.engine.user_profile.quests_completed))
         self.quests_completed_value_label.grid(row=7, column=1, padx=5, pady=2, sticky="w")
 
         self.active_quest_label = ttk.Label(frame, text="Активный квест:")
         self.active_quest_label.grid(row=8, column=0, padx=5, pady=2, sticky="w")
-        if self.active_quest:
-            self.active_quest_value_label = ttk.Label(frame, text=self.active_quest["description"])
-        else:
-            self.active_quest_value_label = ttk.Label(frame, text="Нет активного квеста")
+        self.active_quest_value_label = ttk.Label(frame, text=self.format_quests(), justify="left")
         self.active_quest_value_label.grid(row=8, column=1, padx=5, pady=2, sticky="w")
 
         self.update_profile_button = ttk.Button(frame, text="Сохранить профиль", command=self.update_user_profile)
         self.update_profile_button.grid(row=9, column=0, columnspan=2, padx=5, pady=5)
 
+        # Вкладка может строиться уже после загрузки - заполняем поля текущим профилем
+        self.user_name_entry.insert(0, self.engine.user_profile.name)
+        if self.engine.user_profile.birth_year:
+            self.birth_year_entry.insert(0, str(self.engine.user_profile.birth_year))
+
         frame.columnconfigure(1, weight=1)
 
+    def create_stats_tab(self, frame):
+        self.stats_value_labels = {}
+        rows = [
+            ("tasks_total", "Всего задач:"),
+            ("tasks_completed", "Выполнено:"),
+            ("tasks_open", "Не выполнено:"),
+            ("tasks_overdue", "Просрочено:"),
+            ("tasks_due_today", "Срок сегодня:"),
+            ("habits_today", "Отметок привычек сегодня:"),
+            ("habits_week", "Отметок привычек за неделю:"),
+            ("habits_month", "Отметок привычек за месяц:"),
+        ]
+        for row, (key, text) in enumerate(rows):
+            ttk.Label(frame, text=text).grid(row=row, column=0, padx=5, pady=2, sticky="w")
+            self.stats_value_labels[key] = ttk.Label(frame, text="0")
+            self.stats_value_labels[key].grid(row=row, column=1, padx=5, pady=2, sticky="w")
+
+        self.stats_history_label = ttk.Label(frame, text="Выполнено задач по дням (14 дней):")
+        self.stats_history_label.grid(row=len(rows), column=0, columnspan=2, padx=5, pady=2, sticky="w")
+        self.stats_history_text = tk.Text(frame, width=50, height=14, state="disabled")
+        self.stats_history_text.grid(row=len(rows) + 1, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+
+        columns = ("streak", "longest", "week", "month")
+        self.habit_stats_tree = ttk.Treeview(frame, columns=columns, height=6)
+        self.habit_stats_tree.heading("#0", text="Привычка")
+        for column, text in zip(columns, ("Серия", "Рекорд", "Неделя", "Месяц")):
+            self.habit_stats_tree.heading(column, text=text)
+            self.habit_stats_tree.column(column, width=70, anchor="center", stretch=False)
+        self.habit_stats_tree.grid(row=len(rows) + 2, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+
+        frame.columnconfigure(1, weight=1)
+        frame.rowconfigure(len(rows) + 1, weight=1)
+        frame.rowconfigure(len(rows) + 2, weight=1)
+
+    def create_calendar_tab(self, frame):
+        self.calendar_mode = tk.StringVar(value="month")
+        self.calendar_anchor = datetime.date.today()  # Любой день показываемого месяца или недели
+        self.calendar_selected = self.calendar_anchor
+
+        nav = ttk.Frame(frame)
+        nav.grid(row=0, column=0, padx=5, pady=5, sticky="ew")
+        ttk.Button(nav, text="«", width=3, command=lambda: self.shift_calendar(years=-1)).grid(row=0, column=0)
+        ttk.Button(nav, text="‹", width=3, command=lambda: self.shift_calendar(-1)).grid(row=0, column=1)
+        ttk.Button(nav, text="Сегодня", command=self.calendar_today).grid(row=0, column=2, padx=5)
+        ttk.Button(nav, text="›", width=3, command=lambda: self.shift_calendar(1)).grid(row=0, column=3)
+        ttk.Button(nav, text="»", width=3, command=lambda: self.shift_calendar(years=1)).grid(row=0, column=4)
+        self.calendar_title_label = ttk.Label(nav, text="", font=('Arial', 12, 'bold'))
+        self.calendar_title_label.grid(row=0, column=5, padx=10, sticky="w")
+        ttk.Radiobutton(nav, text="Месяц", value="month", variable=self.calendar_mode,
+                        command=self.render_calendar).grid(row=0, column=6, padx=5)
+        ttk.Radiobutton(nav, text="Неделя", value="week", variable=self.calendar_mode,
+                        command=self.render_calendar).grid(row=0, column=7, padx=5)
+        nav.columnconfigure(5, weight=1)
+
+        # Сетка 6x7 создается один раз; недельный вид использует только первую строку
+        grid = ttk.Frame(frame)
+        grid.grid(row=1, column=0, padx=5, pady=5, sticky="nsew")
+        for column, name in enumerate(WEEKDAY_NAMES):
+            ttk.Label(grid, text=name, anchor="center").grid(row=0, column=column, sticky="ew")
+            grid.columnconfigure(column, weight=1, uniform="day")
+        self.calendar_cells = []
+        for index in range(42):
+            cell = tk.Label(grid, anchor="nw", justify="left", relief="groove", bg="white", width=14, height=4)
+            cell.grid(row=index // 7 + 1, column=index % 7, sticky="nsew")
+            cell.bind("<Button-1>", lambda event, index=index: self.select_calendar_day(index))
+            self.calendar_cells.append(cell)
+        self.calendar_cell_days = [None] * 42
+        for widget in [grid] + self.calendar_cells:
+            widget.bind("<MouseWheel>", self.on_calendar_wheel)
+            widget.bind("<Button-4>", lambda event: self.shift_calendar(-1))
+            widget.bind("<Button-5>", lambda event: self.shift_calendar(1))
+
+        self.calendar_day_text = tk.Text(frame, width=50, height=10, state="disabled")
+        self.calendar_day_text.grid(row=2, column=0, padx=5, pady=5, sticky="nsew")
+
+        frame.columnconfigure(0, weight=1)
+        frame.rowconfigure(1, weight=1)
+
+    def calendar_window(self):
+        # Первый и последний день показываемой сетки
+        anchor = self.calendar_anchor
+        if self.calendar_mode.get() == "month":
+            first_of_month = anchor.replace(day=1)
+            first = first_of_month - datetime.timedelta(days=first_of_month.weekday())
+            return first, first + datetime.timedelta(days=41)
+        first = anchor - datetime.timedelta(days=anchor.weekday())
+        return first, first + datetime.timedelta(days=6)
+
+    def shift_calendar(self, step=0, years=0):
+        # Листание на step месяцев или недель (по виду) и на years лет
+        anchor = self.calendar_anchor
+        if self.calendar_mode.get() == "month":
+            month = anchor.year * 12 + anchor.month - 1 + step + years * 12
+            month = min(max(month, 12), 9999 * 12 + 10)  # Сетка месяца не должна выйти за пределы datetime.date
+            anchor = datetime.date(month // 12, month % 12 + 1, 1)
+        else:
+            if years:
+                year = min(max(anchor.year + years, 1), 9999)
+                try:
+                    anchor = anchor.replace(year=year)
+                except ValueError:  # 29 февраля в невисокосном году
+                    anchor = anchor.replace(year=year, day=28)
+            # Считаем в порядковых номерах: timedelta у границ диапазона date дала бы OverflowError
+            ordinal = min(max(anchor.toordinal() + 7 * step, 1), CALENDAR_LAST_WEEK_DAY.toordinal())
+            anchor = datetime.date.fromordinal(ordinal)
+        self.calendar_anchor = anchor
+        self.render_calendar()
+
+    def calendar_today(self):
+        self.calendar_anchor = self.calendar_selected = datetime.date.today()
+        self.render_calendar()
+
+    def on_calendar_wheel(self, event):
+        self.shift_calendar(-1 if event.delta > 0 else 1)
+
+    def select_calendar_day(self, index):
+        if self.calendar_cell_days[index] is None:
+            return
+        self.calendar_selected = self.calendar_cell_days[index]
+        self.render_calendar()
+
+    @timed()
+    def render_calendar(self):
+        # Перерисовка только открытой вкладки: данные берутся за окно сетки, не больше 42 дней
+        if not self.is_tab_built(self.calendar_frame) or self.notebook.select() != str(self.calendar_frame):
+            return
+        week_mode = self.calendar_mode.get() == "week"
+        first, last = self.calendar_window()
+        if week_mode:
+            title = f"{first.strftime('%d.%m.%Y')} - {last.strftime('%d.%m.%Y')}"
+        else:
+            title = f"{MONTH_NAMES[self.calendar_anchor.month - 1]} {self.calendar_anchor.year}"
+        self.calendar_title_label.config(text=title)
+
+        today = datetime.date.today()
+        days = self.engine.calendar_days(first, last)
+        for index, cell in enumerate(self.calendar_cells):
+            if index >= len(days):
+                self.calendar_cell_days[index] = None
+                cell.grid_remove()
+                continue
+            info = days[index]
+            self.calendar_cell_days[index] = info.day
+            lines = [str(info.day.day)]
+            if info.tasks_due:
+                lines.append(f"Задачи: {info.tasks_due - info.tasks_open}/{info.tasks_due}")
+            elif info.tasks_done:
+                lines.append(f"Выполнено: {info.tasks_done}")
+            if info.habits:
+                lines.append(f"Привычки: {sum(done for _, done in info.habits)}/{len(info.habits)}")
+            elif info.habits_done:
+                lines.append(f"Отметок: {info.habits_done}")
+            if week_mode:
+                lines.extend(f"{'✓' if task.completed else '•'} {task.description}"
+                             for task in self.engine.tasks_due_on(info.day, CALENDAR_WEEK_TASKS))
+                lines.extend(f"{'✓' if done else '○'} {habit.description}" for habit, done in info.habits)
+            if info.day == self.calendar_selected:
+                background = "#cfe3ff"
+            elif info.day == today:
+                background = "#fff4c2"
+            elif info.tasks_open and info.day < today:
+                background = "#f8d0d0"  # Есть просроченные задачи
+            else:
+                background = "white"
+            outside = not week_mode and info.day.month != self.calendar_anchor.month
+            cell.config(text="\n".join(lines), bg=background, fg="gray" if outside else "black",
+                        height=CALENDAR_WEEK_TASKS + 4 if week_mode else 4)
+            cell.grid()
+        self.show_calendar_day(self.calendar_selected)
+
+    def show_calendar_day(self, day):
+        info = self.engine.calendar_days(day, day)[0]
+        lines = [f"{day.strftime('%Y-%m-%d')}, {WEEKDAY_NAMES[day.weekday()]}"]
+        tasks = self.engine.tasks_due_on(day, CALENDAR_DAY_TASKS)
+        if tasks:
+            lines.append(f"Задачи со сроком в этот день ({info.tasks_due}, не выполнено: {info.tasks_open}):")
+            lines.extend(f"  {'✓' if task.completed else '•'} {task.description}" for task in tasks)
+            if info.tasks_due > len(tasks):
+                lines.append(f"  ... и еще {info.tasks_due - len(tasks)}")
+        if info.tasks_done:
+            lines.append(f"Выполнено задач в этот день: {info.tasks_done}")
+        if info.habits:
+            lines.append("Привычки, период которых заканчивается в этот день:")
+            lines.extend(f"  {'✓' if done else '○'} {habit}" for habit, done in info.habits)
+        if info.habits_done:
+            lines.append(f"Отметок привычек в этот день: {info.habits_done}")
+        self.calendar_day_text.config(state="normal")
+        self.calendar_day_text.delete("1.0", tk.END)
+        self.calendar_day_text.insert("1.0", "\n".join(lines))
+        self.calendar_day_text.config(state="disabled")
+
+    @timed()
+    def on_tab_changed(self, event=None):
+        selected = self.notebook.select()
+        if selected in self.tab_builders:
+            self.build_tab(self.notebook.nametowidget(selected))
+        self.update_statistics()
+        if self.debug_frame is not None and selected == str(self.debug_frame):
+            self.refresh_debug_tab()
+
+    def create_debug_tab(self, frame):
+        columns = ("count", "p50", "p99", "max")
+        self.metrics_tree = ttk.Treeview(frame, columns=columns, height=15)
+        self.metrics_tree.heading("#0", text="Операция")
+        self.metrics_tree.column("#0", width=240)
+        for column, text in zip(columns, ("Вызовов", "p50, мс", "p99, мс", "Макс, мс")):
+            self.metrics_tree.heading(column, text=text)
+            self.metrics_tree.column(column, width=70, anchor="e", stretch=False)
+        self.metrics_tree.grid(row=0, column=0, columnspan=4, padx=5, pady=5, sticky="nsew")
+
+        self.profile_actions_label = ttk.Label(frame, text="cProfile на действий:")
+        self.profile_actions_label.grid(row=1, column=0, padx=5, pady=2, sticky="w")
+        self.profile_actions_spinbox = ttk.Spinbox(frame, from_=1, to=1000, width=6)
+        self.profile_actions_spinbox.grid(row=1, column=1, padx=5, pady=2, sticky="w")
+        self.profile_actions_spinbox.set(20)
+        self.profile_button = ttk.Button(frame, text="Начать", command=self.start_profile)
+        self.profile_button.grid(row=1, column=2, padx=5, pady=2, sticky="w")
+        self.profile_status_label = ttk.Label(frame, text="")
+        self.profile_status_label.grid(row=2, column=0, columnspan=4, padx=5, pady=2, sticky="w")
+
+        frame.columnconfigure(3, weight=1)
+        frame.rowconfigure(0, weight=1)
+
+    def refresh_debug_tab(self):
+        # Обновляется раз в секунду, пока вкладка открыта
+        if self._debug_job is not None:
+            self.master.after_cancel(self._debug_job)
+            self._debug_job = None
+        if self.notebook.select() != str(self.debug_frame):
+            return
+        self.metrics_tree.delete(*self.metrics_tree.get_children())
+        for name, count, p50, p99, longest in METRICS.percentiles():
+            self.metrics_tree.insert("", tk.END, text=name, values=(
+                count, f"{p50 * 1000:.2f}", f"{p99 * 1000:.2f}", f"{longest * 1000:.2f}"))
+        if METRICS.profiling:
+            self.profile_status_label.config(text=f"Идет профилирование, осталось действий: {METRICS.profile_left}")
+        elif METRICS.profile_path:
+            self.profile_status_label.config(text=f"Профиль сохранен в {METRICS.profile_path}")
+        self._debug_job = self.master.after(1000, self.refresh_debug_tab)
+
+    def start_profile(self):
+        try:
+            actions = int(self.profile_actions_spinbox.get())
+        except ValueError:
+            messagebox.showerror("Ошибка", "Укажите число действий")
+            return
+        METRICS.profile_next(actions, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+        self.refresh_debug_tab()
+
+    def monitor_event_loop(self, expected=None):
+        # Задержка цикла Tk: насколько позже запланированного сработал таймер
+        now = time.perf_counter()
+        if expected is not None:
+            lag = max(0.0, now - expected)
+            METRICS.record("event_loop.lag", lag, log=lag >= LAG_LOG_THRESHOLD)
+        self.master.after(LAG_CHECK_INTERVAL_MS, self.monitor_event_loop, now + LAG_CHECK_INTERVAL_MS / 1000)
+
+    @timed()
+    def update_statistics(self):
+        # Перерисовываем только открытую вкладку статистики; все значения берутся из агрегатов за O(1).
+        # Календарь строится из тех же агрегатов и обновляется вместе со статистикой
+        if self.notebook.select() == str(self.calendar_frame):
+            self.render_calendar()
+            return
+        if self.notebook.select() != str(self.stats_frame):
+            return
+        today = datetime.date.today()
+        year, week, _ = today.isocalendar()
+        values = {
+            "tasks_total": self.engine.stats.tasks_total,
+            "tasks_completed": self.engine.stats.tasks_completed,
+            "tasks_open": self.engine.stats.tasks_open,
+            "tasks_overdue": self.engine.stats.overdue(today),
+            "tasks_due_today": self.engine.stats.due_on(today),
+            "habits_today": self.engine.stats.habit_completions_by_day[today],
+            "habits_week": self.engine.stats.habit_completions_by_week[(year, week)],
+            "habits_month": self.engine.stats.habit_completions_by_month[(today.year, today.month)],
+        }
+        for key, value in values.items():
+            self.stats_value_labels[key].config(text=str(value))
+
+        lines = []
+        for offset in range(13, -1, -1):
+            day = today - datetime.timedelta(days=offset)
+            count = self.engine.stats.task_completions_by_day[day]
+            lines.append(f"{day.strftime('%Y-%m-%d')} {'#' * min(count, 40)} {count}")
+        self.stats_history_text.config(state="normal")
+        self.stats_history_text.delete("1.0", tk.END)
+        self.stats_history_text.insert("1.0", "\n".join(lines))
+        self.stats_history_text.config(state="disabled")
+
+        self.habit_stats_tree.delete(*self.habit_stats_tree.get_children())
+        for habit in self.engine.habits:
+            current, longest = habit_streaks(habit, today)
+            rates = [habit_completion_rate(habit, window, today) for window in ("week", "month")]
+            self.habit_stats_tree.insert("", tk.END, text=str(habit), values=(
+                current, longest, *("-" if rate is None else f"{rate:.0%}" for rate in rates)))
+
+    @timed()
     def browse_avatar(self):
+        if self._loader is not None:
+            return  # Во время загрузки модель пересобирается, изменять ее нельзя
         file_path = filedialog.askopenfilename(
             initialdir=os.getcwd(),
             title="Выберите файл аватарки",
             filetypes=[("Image files", "*.png;*.jpg;*.jpeg;*.gif")]
         )
         if file_path:
-            self.user_profile.avatar_path = file_path
+            self.engine.set_avatar(file_path)
             self.load_avatar()
-            self.save_data()
 
+    @timed()
     def load_avatar(self):
-        if self.user_profile.avatar_path:
-            try:
-                image = Image.open(self.user_profile.avatar_path)
-                image = image.resize((100, 100), Image.Resampling.LANCZOS)  # Измените размер по желанию
-                self.avatar_image = ImageTk.PhotoImage(image)
-                self.avatar_image_label.config(image=self.avatar_image)
-            except Exception as e:
-                print(f"Ошибка при загрузке аватарки: {e}")
-                messagebox.showerror("Ошибка", f"Не удалось загрузить аватарку: {e}")
+        if not self.is_tab_built(self.user_frame):
+            return  # Аватарка загрузится при первом открытии вкладки профиля
+        path = self.engine.user_profile.avatar_path
+        if path:
+            # Декодирование в фоне, PhotoImage создается уже в главном потоке
+            self.avatar_loader.load_async(
+                path,
+                on_done=lambda image: self.call_in_ui(self.show_avatar, path, image),
+                on_error=lambda e: self.call_in_ui(self.show_avatar_error, path, e))
         else:
             # Устанавливаем пустое изображение, если аватарка отсутствует
             self.avatar_image_label.config(image="")
 
+    @timed()
+    def show_avatar(self, path, image):
+        if path != self.engine.user_profile.avatar_path:
+            return  # Пока шло декодирование, выбрали другую аватарку
+        from PIL import ImageTk
+
+        self.avatar_image = ImageTk.PhotoImage(image)
+        self.avatar_image_label.config(image=self.avatar_image)
+
+    def show_avatar_error(self, path, e):
+        if path != self.engine.user_profile.avatar_path:
+            return
+        print(f"Ошибка при загрузке аватарки: {e}")
+        messagebox.showerror("Ошибка", f"Не удалось загрузить аватарку: {e}")
+
+    @timed()
     def add_task(self):
+        if self._loader is not None:
+            return
         description = self.task_description_entry.get()
         due_date_str = self.task_due_date_entry.get()
 
@@ -288,75 +3714,250 @@ class TaskManager:
             return
 
         if description and due_date:
-            task = Task(description, due_date)
-            self.tasks.append(task)
-            self.update_task_list()
+            self.engine.add_task(description, due_date)
             self.task_description_entry.delete(0, tk.END)
             self.task_due_date_entry.delete(0, tk.END)
-            self.save_data()
         else:
             messagebox.showerror("Ошибка", "Пожалуйста, заполните описание и дату.")
 
+    @timed()
     def add_habit(self):
+        if self._loader is not None:
+            return
         description = self.habit_description_entry.get()
         frequency = self.habit_frequency_combobox.get()
 
         if description and frequency:
-            habit = Habit(description, frequency)
-            self.habits.append(habit)
-            self.update_habit_list()
+            self.engine.add_habit(description, frequency)
             self.habit_description_entry.delete(0, tk.END)
-            self.save_data()
         else:
             messagebox.showerror("Ошибка", "Пожалуйста, заполните описание и частоту.")
 
+    @timed()
     def complete_task(self, event=None):
-        try:
-            selected_index = self.task_listbox.curselection()[0]
-            task = self.tasks[selected_index]
-            task.completed = not task.completed
+        if self._loader is not None:
+            return
+        task_ids = [task_id for task_id in self.task_list.selected() if task_id in self.engine.tasks]
+        if not task_ids:
+            messagebox.showinfo("Информация", "Выберите задачу для отметки как выполненной/невыполненной.")
+            return
+        if len(task_ids) == 1:
+            self.engine.toggle_task(task_ids[0])
+            return
+        # Если среди выбранных есть невыполненные - отмечаем их, иначе снимаем отметку со всех
+        completed = any(not self.engine.tasks[task_id].completed for task_id in task_ids)
+        self.engine.complete_tasks(task_ids, completed)
+
+    @timed()
+    def complete_habit(self, event=None):
+        if self._loader is not None:
+            return
+        habit_ids = [habit_id for habit_id in self.habit_list.selected() if habit_id in self.engine.habits_by_id]
+        if not habit_ids:
+            messagebox.showinfo("Информация", "Выберите привычку для отметки выполнения.")
+            return
+        if len(habit_ids) == 1:
+            self.engine.toggle_habit(habit_ids[0])
+            return
+        today = datetime.date.today()
+        marked = any(today not in self.engine.habits_by_id[habit_id].completed_dates for habit_id in habit_ids)
+        self.engine.mark_habits(habit_ids, marked)
+
+    @timed()
+    def on_task_added(self, task):
+        if self.task_filter:
+            self.update_task_list()  # Новая задача может не подходить под фильтр
+        else:
+            self.task_list.append(task.id)
+        self.update_statistics()
+
+    @timed()
+    def on_task_changed(self, task):
+        if self.task_filter and self.task_filter[3]:
+            self.update_task_list()  # Выполненная задача уходит из списка невыполненных
+        else:
+            self.task_list.refresh(task.id)
+        self.update_statistics()
+
+    @timed()
+    def on_habit_added(self, habit):
+        if self.is_tab_built(self.habit_frame):
+            self.habit_list.append(habit.id)
+        self.update_statistics()
+
+    @timed()
+    def on_items_imported(self, tasks, habits):
+        # Одна перерисовка списков на порцию импорта
+        if tasks:
             self.update_task_list()
-            self.save_data()
+        if habits:
+            self.update_habit_list()
+        self.update_statistics()
 
-            if task.completed:
-                self.award_experience(10)  # Награждаем опытом за выполнение задачи
-                self.check_quest_completion()  # Проверяем, завершили ли квест
+    @timed()
+    def on_tasks_changed(self, items):
+        if self.task_filter and self.task_filter[3]:
+            self.update_task_list()
+        else:
+            self.task_list.refresh_visible()
+        self.update_statistics()
 
-        except IndexError:
-            messagebox.showinfo("Информация", "Выберите задачу для отметки как выполненной/невыполненной.")
+    @timed()
+    def on_habits_changed(self, items):
+        if self.is_tab_built(self.habit_frame):
+            self.habit_list.refresh_visible()
+        self.update_statistics()
 
-    def complete_habit(self, event=None):
-        try:
-            selected_index = self.habit_listbox.curselection()[0]
-            habit = self.habits[selected_index]
-            today = datetime.date.today().strftime("%Y-%m-%d")
-            if today in habit.completed_dates:
-                del habit.completed_dates[today]
-            else:
-                habit.completed_dates[today] = True
+    def undo(self, event=None):
+        if self._loader is None and self._transfer is None and self.engine.undo() is None:
+            self.master.bell()
+
+    def redo(self, event=None):
+        if self._loader is None and self._transfer is None and self.engine.redo() is None:
+            self.master.bell()
+
+    @timed()
+    def on_history_applied(self, label, structure_changed, profile_fields):
+        if structure_changed:
+            self.update_task_list()
             self.update_habit_list()
-            self.save_data()
+        else:
+            if self.task_filter:
+                self.update_task_list()  # Отмена могла изменить выполнение задач, подходящих под фильтр
+            else:
+                self.task_list.refresh_visible()
+            if self.is_tab_built(self.habit_frame):
+                self.habit_list.refresh_visible()
+        self.update_statistics()
+        self.refresh_profile_labels()
+        if self.is_tab_built(self.user_frame) and profile_fields & {"name", "birth_year"}:
+            # Иначе следующее сохранение профиля вернуло бы отмененные значения из полей ввода
+            self.user_name_entry.delete(0, tk.END)
+            self.user_name_entry.insert(0, self.engine.user_profile.name)
+            self.birth_year_entry.delete(0, tk.END)
+            if self.engine.user_profile.birth_year:
+                self.birth_year_entry.insert(0, str(self.engine.user_profile.birth_year))
+        if "avatar_path" in profile_fields:
+            self.load_avatar()
 
-            self.award_experience(5)  # Награждаем опытом за выполнение привычки
-            self.check_quest_completion()  # Проверяем, завершили ли квест
+    def on_batch_completed(self, count, experience, levels, quests_completed, quests_expired, quests_assigned):
+        # Одна сводка вместо отдельных сообщений о профиле, уровнях и квестах
+        self.refresh_profile_labels()
+        message = f"Отмечено: {count}."
+        if experience:
+            message += f"\nПолучено опыта: {experience}."
+        if levels:
+            message += f"\nПоздравляем! Вы достигли {levels[-1]} уровня!"
+        for quest in quests_completed:
+            message += f"\nВы выполнили квест: {quest['description']}! Награда: {quest['reward']} опыта."
+        for quest in quests_expired:
+            message += f"\nСрок квеста истек: {quest['description']}"
+        for quest in quests_assigned:
+            message += f"\nВам назначен новый квест: {quest['description']}"
+        messagebox.showinfo("Готово", message)
 
-        except IndexError:
-            messagebox.showinfo("Информация", "Выберите привычку для отметки выполнения.")
+    @timed()
+    def on_habit_changed(self, habit):
+        if self.is_tab_built(self.habit_frame):
+            self.habit_list.refresh(habit.id)
+        self.update_statistics()
+
+    def on_level_up(self, level):
+        messagebox.showinfo("Повышение уровня!", f"Поздравляем! Вы достигли {level} уровня!")
+
+    def on_quest_assigned(self, quests):
+        messagebox.showinfo("Новый квест!", "\n".join(f"Вам назначен новый квест: {quest['description']}"
+                                                      for quest in quests))
+
+    def on_quest_completed(self, quest):
+        messagebox.showinfo("Квест выполнен!",
+                            f"Вы выполнили квест: {quest['description']}! Награда: {quest['reward']} опыта.")
+
+    def on_quest_expired(self, quest):
+        messagebox.showinfo("Квест просрочен", f"Срок квеста истек: {quest['description']}")
 
+    def on_save_failed(self, error):
+        # Приходит из потока записи
+        self.call_in_ui(messagebox.showerror, "Ошибка", f"Не удалось сохранить данные: {error}")
+
+    @timed()
     def update_task_list(self):
-        self.task_listbox.delete(0, tk.END)
-        for i, task in enumerate(self.tasks):
-            status = "[Выполнено]" if task.completed else ""
-            self.task_listbox.insert(tk.END, f"{i + 1}. {task} {status}")
+        if self.task_filter:
+            self.task_list.set_items(self.engine.find_tasks(*self.task_filter))
+        else:
+            self.task_list.set_items(self.engine.tasks.ids)
+
+    def schedule_task_filter(self, event=None):
+        # Фильтр применяется после короткой паузы во вводе, а не на каждую клавишу
+        if self._task_filter_job is not None:
+            self.master.after_cancel(self._task_filter_job)
+        self._task_filter_job = self.master.after(100, self.apply_task_filter)
+
+    @timed()
+    def apply_task_filter(self):
+        self._task_filter_job = None
+        text = self.task_search_entry.get()
+        mode = self.task_filter_combobox.get()
+        today = datetime.date.today()
+        first = last = None
+        open_only = False
+        if mode == "Невыполненные":
+            open_only = True
+        elif mode == "Просроченные":
+            last = today - datetime.timedelta(days=1)
+            open_only = True
+        elif mode == "Сегодня":
+            first = last = today
+        elif mode == "На этой неделе":
+            first = today - datetime.timedelta(days=today.weekday())
+            last = first + datetime.timedelta(days=6)
+        elif mode == "За период":
+            first_text = self.task_from_entry.get().strip()
+            last_text = self.task_to_entry.get().strip()
+            try:
+                first = parse_date(first_text) if first_text else None
+                last = parse_date(last_text) if last_text else None
+            except ValueError:
+                return  # Дата еще вводится - оставляем прежний результат
+        new_filter = (text, first, last, open_only) if text.strip() or first or last or open_only else None
+        if new_filter != self.task_filter:
+            self.task_filter = new_filter
+            ids = self.engine.find_tasks(*new_filter) if new_filter else self.engine.tasks.ids
+            self.task_list.set_items(ids, first=0)
 
+    @timed()
     def update_habit_list(self):
-        self.habit_listbox.delete(0, tk.END)
-        for i, habit in enumerate(self.habits):
-            completed_today = datetime.date.today().strftime("%Y-%m-%d") in habit.completed_dates
-            status = "[Выполнено сегодня]" if completed_today else ""
-            self.habit_listbox.insert(tk.END, f"{i + 1}. {habit} {status}")
+        if not self.is_tab_built(self.habit_frame):
+            return
+        self.habit_list.set_items(habit.id for habit in self.engine.habits)
+
+    def format_task_rows(self, first_index, ids):
+        rows = []
+        for i, task_id in enumerate(ids, first_index):
+            task = self.engine.tasks[task_id]
+            status = "[Выполнено]" if task.completed else ""
+            rows.append(f"{i + 1}. {task} {status}")
+        return rows
+
+    def format_habit_rows(self, first_index, ids):
+        today = datetime.date.today().strftime("%Y-%m-%d")
+        rows = []
+        for i, habit_id in enumerate(ids, first_index):
+            habit = self.engine.habits_by_id[habit_id]
+            status = "[Выполнено сегодня]" if today in habit.completed_dates else ""
+            rows.append(f"{i + 1}. {habit} {status}")
+        return rows
 
+    @timed()
     def update_user_profile(self, event=None):
+        if self._loader is not None:
+            return
+        if not self.is_tab_built(self.user_frame):
+            # Вкладка профиля еще не открывалась: полей ввода нет, сохраняем профиль как есть
+            self.engine.save()
+            messagebox.showinfo("Информация", "Профиль пользователя обновлен!")
+            return
+
         # Get data from entry fields
         name = self.user_name_entry.get()
         birth_year_str = self.birth_year_entry.get()
@@ -372,81 +3973,52 @@ class TaskManager:
             return
 
         # Update user profile
-        self.user_profile.name = name if name else "Новый пользователь"
-        self.user_profile.birth_year = birth_year
+        self.engine.update_profile(name, birth_year)
 
         # Update GUI labels
-        self.level_value_label.config(text=str(self.user_profile.level))
-        self.experience_value_label.config(text=str(self.user_profile.experience))
-        self.quests_completed_value_label.config(text=str(self.user_profile.quests_completed))
+        self.refresh_profile_labels()
 
         # Update the name entry field
         self.user_name_entry.delete(0, tk.END)
-        self.user_name_entry.insert(0, self.user_profile.name)
+        self.user_name_entry.insert(0, self.engine.user_profile.name)
 
-        self.save_data()
         messagebox.showinfo("Информация", "Профиль пользователя обновлен!")
 
-    def award_experience(self, amount):
-        self.user_profile.experience += amount
-        self.check_level_up()
-        self.update_user_profile()
-        self.save_data()
-
-    def check_level_up(self):
-        level_up_threshold = self.user_profile.level * 100
-        if self.user_profile.experience >= level_up_threshold:
-            self.user_profile.level += 1
-            self.user_profile.experience -= level_up_threshold
-            messagebox.showinfo("Повышение уровня!", f"Поздравляем! Вы достигли {self.user_profile.level} уровня!")
-
-    def assign_quest(self):
-        if self.quests and not self.active_quest:
-            self.active_quest = random.choice(self.quests)
-            self.update_user_profile()
-            messagebox.showinfo("Новый квест!", f"Вам назначен новый квест: {self.active_quest['description']}")
-
-    def check_quest_completion(self):
-        if self.active_quest:
-            if self.active_quest["type"] == "complete_tasks":
-                completed_task_count = sum(1 for task in self.tasks if task.completed)
-                if completed_task_count >= self.active_quest["amount"]:
-                    self.complete_quest()
-            elif self.active_quest["type"] == "complete_habits":
-                completed_habit_today = any(
-                    habit.completed_dates.get(datetime.date.today().strftime("%Y-%m-%d")) for habit in self.habits)
-                if completed_habit_today:
-                    self.complete_quest()
-
-    def complete_quest(self):
-        messagebox.showinfo("Квест выполнен!",
-                            f"Вы выполнили квест: {self.active_quest['description']}! Награда: {self.active_quest['reward']} опыта.")
-        self.award_experience(self.active_quest["reward"])
-        self.user_profile.quests_completed += 1
-        self.active_quest = None
-        self.assign_quest()
-        self.update_user_profile()
-
-    def load_quests(self):
-        return [
-            {"type": "complete_tasks", "description": "Выполните 3 задачи", "amount": 3, "reward": 50},
-            {"type": "complete_habits", "description": "Отметьте выполнение хотя бы одной привычки сегодня", "amount": 1,
-             "reward": 30}
-        ]
+    def refresh_profile_labels(self):
+        if not self.is_tab_built(self.user_frame):
+            return
+        self.level_value_label.config(text=str(self.engine.user_profile.level))
+        self.experience_value_label.config(text=str(self.engine.user_profile.experience))
+        self.quests_completed_value_label.config(text=str(self.engine.user_profile.quests_completed))
+        self.active_quest_value_label.config(text=self.format_quests())
 
-    def check_reminders(self):
-        while True:
-            now = datetime.datetime.now()
-            for task in self.tasks:
-                if not task.completed and task.due_date <= now.date():
-                    self.show_notification("Задача!", f"Задача '{task.description}' должна быть выполнена сегодня!")
+    def format_quests(self):
+        lines = [f"{quest['description']} ({progress}/{quest['amount']})"
+                 for quest, progress in self.engine.quest_engine.progress()]
+        return "\n".join(lines) or "Нет активного квеста"
 
-            # TODO: Добавить логику для напоминаний о привычках (в зависимости от частоты)
+    def queue_reminder(self, key):
+        # Из потока планировщика: ключи копятся, главный поток разбирает их порциями
+        with self._fired_lock:
+            self._fired_reminders.append(key)
+            first = len(self._fired_reminders) == 1
+        if first:
+            self.call_in_ui(self.on_reminders)
 
-            time.sleep(60)
+    @timed()
+    def on_reminders(self):
+        # Сработавшие напоминания, выполняется в главном потоке. Уведомления показывает очередь engine.notifications
+        with self._fired_lock:
+            keys = self._fired_reminders[:REMINDER_BATCH_SIZE]
+            del self._fired_reminders[:REMINDER_BATCH_SIZE]
+            more = bool(self._fired_reminders)
+        for key in keys:
+            self.engine.process_reminder(key)
+        if more:
+            self.master.after(0, self.on_reminders)
 
     def show_notification(self, title, message):
-        if HAS_PLYER:
+        if load_plyer():
             notification.notify(
                 title=title,
                 message=message,
@@ -455,50 +4027,178 @@ class TaskManager:
         else:
             messagebox.showinfo(title, message)
 
-    def save_data(self):
+    def call_in_ui(self, func, *args):
+        self._ui_calls.put((func, args))
+
+    def process_ui_calls(self):
+        # Ошибка в одном вызове (например, plyer без подходящего бэкенда) не должна останавливать очередь
         try:
-            data = {
-                "tasks": [task.to_dict() for task in self.tasks],
-                "habits": [habit.to_dict() for habit in self.habits],
-                "user_profile": self.user_profile.to_dict()
-            }
-            with open(self.data_file, "w") as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"Ошибка при сохранении данных: {e}")
-            messagebox.showerror("Ошибка", f"Не удалось сохранить данные: {e}")
+            while True:
+                try:
+                    func, args = self._ui_calls.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"Ошибка при обработке вызова из фонового потока: {e}")
+        finally:
+            self.master.after(100, self.process_ui_calls)
+
+    def on_close(self):
+        self.engine.close()
+        self.master.destroy()
+
+    def load_data(self, on_done=None):
+        # Загрузка порциями в цикле Tk: окно остается отзывчивым, ход загрузки виден на индикаторе
+        if self._loader is not None or self._transfer is not None:
+            return
+        self._loader = self.engine.begin_load(LOAD_BATCH_SIZE)
+        # Модель уже пуста: прежние id в списках не должны попасть в format_task_rows/format_habit_rows
+        self.task_list.set_items([])
+        if self.is_tab_built(self.habit_frame):
+            self.habit_list.set_items([])
+        self._on_loaded = on_done
+        self.load_progress["value"] = 0
+        self.load_progress.grid()
+        self.master.after(0, self.load_step)
 
-    def load_data(self):
+    @timed()
+    def load_step(self):
         try:
-            if os.path.exists(self.data_file):
-                with open(self.data_file, "r") as f:
-                    data = json.load(f)
-                    self.tasks = [Task.from_dict(t) for t in data.get("tasks", [])]
-                    self.habits = [Habit.from_dict(h) for h in data.get("habits", [])]
-                    user_profile_data = data.get("user_profile")
-                    if user_profile_data:
-                        self.user_profile = UserProfile.from_dict(user_profile_data)
-        except FileNotFoundError:
-            print("Файл данных не найден. Начинаем с чистого листа.")
-        except json.JSONDecodeError:
+            kind, items, progress = next(self._loader)
+        except StopIteration:
+            self.finish_loading()
+            return
+        except (ValueError, sqlite3.DatabaseError):  # В том числе JSONDecodeError, UnicodeDecodeError и неверные даты
             print("Ошибка при загрузке данных: Файл поврежден.")
             messagebox.showerror("Ошибка", "Файл данных поврежден. Начинаем с чистого листа.")
-            self.tasks = []
-            self.habits = []
-            self.user_profile = UserProfile()
+            self.engine.reset(keep_profile=False)
+            self.finish_loading()
+            return
         except Exception as e:
             print(f"Неожиданная ошибка при загрузке данных: {e}")
             messagebox.showerror("Ошибка", f"Неожиданная ошибка при загрузке данных: {e}")
+            self.finish_loading()
+            return
+
+        self.engine.apply_loaded(kind, items)
+        self.load_progress["value"] = progress * 100
+        # Следующая порция - после того, как Tk обработает события и перерисует окно
+        self.master.after_idle(self.master.after, 0, self.load_step)
+
+    def import_data(self):
+        if self._loader is not None or self._transfer is not None:
+            return
+        path = filedialog.askopenfilename(title="Импорт задач и привычек", filetypes=TRANSFER_FILETYPES)
+        if not path:
+            return
+        try:
+            transfer_format(path)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
+        self._transfer = import_batches(path)
+        self._import_counts = [0, 0, 0]  # Задачи, привычки, пропущенные повторы
+        self._import_errors = []
+        self._import_error_count = 0
+        self.load_progress["value"] = 0
+        self.load_progress.grid()
+        self.master.after(0, self.import_step)
+
+    @timed()
+    def import_step(self):
+        try:
+            tasks, habits, errors, progress = next(self._transfer)
+        except StopIteration:
+            self.finish_transfer()
+            self.show_import_summary()
+            return
+        except (OSError, ValueError, csv.Error) as e:
+            print(f"Ошибка при импорте: {e}")
+            self.finish_transfer()
+            messagebox.showerror("Ошибка", f"Импорт прерван: {e}")
+            self.show_import_summary()
+            return
+
+        skipped = self.engine.import_items(tasks, habits)
+        self._import_counts[0] += len(tasks)
+        self._import_counts[1] += len(habits)
+        self._import_counts[2] += skipped
+        self._import_error_count += len(errors)
+        self._import_errors.extend(errors[:10 - len(self._import_errors)])  # Для отчета хватит первых
+        self.load_progress["value"] = progress * 100
+        self.master.after_idle(self.master.after, 0, self.import_step)
+
+    def show_import_summary(self):
+        tasks, habits, skipped = self._import_counts
+        message = f"Прочитано задач: {tasks}, привычек: {habits}."
+        if skipped:
+            message += f"\nУже были в списке и пропущены: {skipped}."
+        if self._import_error_count:
+            message += f"\nЗаписей с ошибками: {self._import_error_count}."
+            message += "".join(f"\nСтрока {line}: {reason}" for line, reason in self._import_errors)
+        messagebox.showinfo("Импорт завершен", message)
+
+    def export_data(self):
+        if self._loader is not None or self._transfer is not None:
+            return
+        path = filedialog.asksaveasfilename(title="Экспорт задач и привычек", defaultextension=".csv",
+                                            filetypes=TRANSFER_FILETYPES)
+        if not path:
+            return
+        try:
+            transfer_format(path)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
+        # Экспорт идет порциями между действиями пользователя, поэтому пишем неизменяемый снимок
+        snapshot = self.engine.publish()
+        snapshot.tasks.take()
+        self._transfer = export_items(path, snapshot.tasks, snapshot.habits)
+        self._export_path = path
+        self.load_progress["value"] = 0
+        self.load_progress.grid()
+        self.master.after(0, self.export_step)
+
+    @timed()
+    def export_step(self):
+        try:
+            progress = next(self._transfer)
+        except StopIteration:
+            self.finish_transfer()
+            messagebox.showinfo("Экспорт завершен", f"Задачи и привычки сохранены в {self._export_path}")
+            return
+        except OSError as e:
+            print(f"Ошибка при экспорте: {e}")
+            self.finish_transfer()
+            messagebox.showerror("Ошибка", f"Не удалось экспортировать данные: {e}")
+            return
+        self.load_progress["value"] = progress * 100
+        self.master.after_idle(self.master.after, 0, self.export_step)
+
+    def finish_transfer(self):
+        self._transfer = None
+        self.load_progress.grid_remove()
 
-    def start_reminder_thread(self):
-        reminder_thread = threading.Thread(target=self.check_reminders, daemon=True)
-        reminder_thread.start()
+    @timed()
+    def finish_loading(self):
+        self._loader = None
+        self.engine.finish_load()
+        self.update_statistics()
+        self.update_task_list()
+        self.update_habit_list()
+        self.load_progress.grid_remove()
+        on_done, self._on_loaded = self._on_loaded, None
+        if on_done:
+            on_done()
 
 
-root = tk.Tk()
-root.geometry("600x500")
-root.columnconfigure(0, weight=1)
-root.rowconfigure(0, weight=1)
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.geometry("600x500")
+    root.columnconfigure(0, weight=1)
+    root.rowconfigure(0, weight=1)
 
-task_manager = TaskManager(root)
-root.mainloop()
+    task_manager = TaskManager(root)
+    root.mainloop()